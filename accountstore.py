@@ -0,0 +1,315 @@
+import heapq
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+
+from potfile import JohnRecord, account_name, iter_john_lines, unique_records
+
+BLANK_LM = bytes.fromhex("aad3b435b51404eeaad3b435b51404ee")
+BLANK_NTLM = bytes.fromhex("31d6cfe0d16ae931b73c59d7e0c089c0")
+
+# Leading digest bits of the counting sort buckets of HashIndex
+_SORT_BITS = 16
+
+NO_DOMAIN = 0xFFFFFFFF
+NO_RID = 0xFFFFFFFF
+_ZERO_DIGEST = bytes(16)
+
+# Account flag bits
+CRACKED = 1
+MACHINE = 2
+HAS_LM = 4
+HAS_NTLM = 8
+ENABLED = 16
+DISABLED = 32
+
+
+class _StringColumn:
+    """Strings stored back to back in one UTF-8 buffer with an array of end offsets"""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.ends = array('Q')
+
+    def append(self, value):
+        self.data += value.encode("utf-8", "surrogatepass")
+        self.ends.append(len(self.data))
+
+    def __getitem__(self, index):
+        start = self.ends[index - 1] if index else 0
+        return self.data[start:self.ends[index]].decode("utf-8", "surrogatepass")
+
+    def nbytes(self):
+        return len(self.data) + self.ends.itemsize * len(self.ends)
+
+
+class AccountStore:
+    """Compact column store of the accounts in john --show / pwdump output.
+
+    Every field of the line format is kept: domains are interned to integer ids, usernames,
+    passwords and pwdLastSet values are packed into string columns, RIDs into an integer array
+    and LM/NTLM hashes into 16 bytes each of a bytearray. Status, cracked and machine account
+    information live in one flags byte. An account costs a little over 60 bytes plus its
+    strings, a fraction of a dict per account, and ingest keeps a hash of every account name to
+    skip repeated accounts.
+    """
+
+    def __init__(self):
+        self.domains = []
+        self._domain_ids = {}
+        self.domain = array('I')
+        self.rid = array('I')
+        self.lm = bytearray()
+        self.ntlm = bytearray()
+        self.flags = bytearray()
+        self.usernames = _StringColumn()
+        self.passwords = _StringColumn()
+        self.last_set = _StringColumn()
+        self._seen = set()  # hashes of the account names ingested, see potfile.unique_records
+
+    def __len__(self):
+        return len(self.flags)
+
+    def append(self, record):
+        """Add a JohnRecord and return its account index"""
+        if record.domain is None:
+            domain = NO_DOMAIN
+        else:
+            # Domains are case insensitive: ACME and acme share the id and the first spelling seen
+            key = record.domain.lower()
+            domain = self._domain_ids.get(key)
+            if domain is None:
+                domain = self._domain_ids[key] = len(self.domains)
+                self.domains.append(record.domain)
+
+        flags = 0
+        if record.password is not None:
+            flags |= CRACKED
+        if record.username.endswith("$"):
+            flags |= MACHINE
+        if record.lm is not None:
+            flags |= HAS_LM
+        if record.ntlm is not None:
+            flags |= HAS_NTLM
+        if record.enabled is True:
+            flags |= ENABLED
+        elif record.enabled is False:
+            flags |= DISABLED
+
+        self.domain.append(domain)
+        self.rid.append(NO_RID if record.rid is None else record.rid)
+        self.lm += record.lm or _ZERO_DIGEST
+        self.ntlm += record.ntlm or _ZERO_DIGEST
+        self.flags.append(flags)
+        self.usernames.append(record.username)
+        self.passwords.append(record.password or "")
+        self.last_set.append(record.last_set or "")
+        return len(self.flags) - 1
+
+    def ingest(self, source, use_mmap=False, start=0, stop=None, machine=False):
+        """Store every account line of source while yielding (username, password) for the cracked ones.
+
+        The username is qualified with the domain as in the input. Lines are parsed and deduplicated
+        like potfile.iter_john_records, so the yielded records are the same and can feed the analysis
+        pipeline in the same pass. Machine accounts are stored but only yielded if machine is set.
+        """
+        return self.extend(unique_records(iter_john_lines(source, use_mmap, start, stop), self._seen), machine)
+
+    def extend(self, records, machine=False):
+        """Store JohnRecords, e.g. merged from several inputs, while yielding (username, password) for the
+        cracked ones like ingest"""
+        for record in records:
+            index = self.append(record)
+            if record.password is not None and (machine or not self.flags[index] & MACHINE):
+                yield account_name(record), record.password
+
+    @classmethod
+    def from_john(cls, source, use_mmap=False):
+        """Build a store from john --show or pwdump output"""
+        store = cls()
+        for record in store.ingest(source, use_mmap, machine=True):
+            pass
+        return store
+
+    def domain_name(self, index):
+        domain = self.domain[index]
+        return None if domain == NO_DOMAIN else self.domains[domain]
+
+    def username(self, index):
+        return self.usernames[index]
+
+    def password(self, index):
+        return self.passwords[index] if self.flags[index] & CRACKED else None
+
+    def lm_digest(self, index):
+        return bytes(self.lm[index * 16:index * 16 + 16]) if self.flags[index] & HAS_LM else None
+
+    def ntlm_digest(self, index):
+        return bytes(self.ntlm[index * 16:index * 16 + 16]) if self.flags[index] & HAS_NTLM else None
+
+    def enabled(self, index):
+        flags = self.flags[index]
+        return True if flags & ENABLED else False if flags & DISABLED else None
+
+    def record(self, index):
+        """Return the account at index as a JohnRecord"""
+        rid = self.rid[index]
+        return JohnRecord(self.domain_name(index), self.usernames[index], self.password(index),
+                          None if rid == NO_RID else rid, self.lm_digest(index), self.ntlm_digest(index),
+                          self.last_set[index] or None, self.enabled(index))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.record(index)
+
+    def nbytes(self):
+        """Approximate memory held by the columns"""
+        return (self.domain.itemsize * len(self.domain) + self.rid.itemsize * len(self.rid) + len(self.lm) +
+                len(self.ntlm) + len(self.flags) + self.usernames.nbytes() + self.passwords.nbytes() +
+                self.last_set.nbytes())
+
+
+class HashIndex:
+    """Index from the LM or NTLM digests of an AccountStore to the accounts sharing them.
+
+    The non-blank digests are split into two 64-bit halves and sorted with their account indexes,
+    bucketed by the leading bits of the digest so only one small bucket is sorted as Python objects
+    at a time. The result is kept as parallel arrays (the two halves and the account index) plus
+    the start of each run of equal digests. Runs are the reuse clusters, so unique counts, the
+    largest clusters, cross-domain reuse and lookups by digest are all cheap without holding any
+    Python objects per account.
+    """
+
+    def __init__(self, store, column="ntlm"):
+        if column == "ntlm":
+            digests, has, blank = store.ntlm, HAS_NTLM, BLANK_NTLM
+        elif column == "lm":
+            digests, has, blank = store.lm, HAS_LM, BLANK_LM
+        else:
+            raise ValueError("unknown hash column %r" % column)
+        self.store = store
+        self.column = column
+        self.blank = 0
+
+        blank_hi, blank_lo = struct.unpack(">QQ", blank)
+        flags = store.flags
+        his, los, indexes = array('Q'), array('Q'), array('I')
+        for index, (hi, lo) in enumerate(struct.iter_unpack(">QQ", digests)):
+            if not flags[index] & has:
+                continue
+            if hi == blank_hi and lo == blank_lo:
+                self.blank += 1
+                continue
+            his.append(hi)
+            los.append(lo)
+            indexes.append(index)
+
+        # Counting sort on the top bits of the digest, then sort the few digests of each bucket
+        shift = 64 - _SORT_BITS
+        bounds = array('I', bytes(4 * ((1 << _SORT_BITS) + 1)))
+        for hi in his:
+            bounds[(hi >> shift) + 1] += 1
+        for bucket in range(1 << _SORT_BITS):
+            bounds[bucket + 1] += bounds[bucket]
+        order = array('I', bytes(4 * len(his)))
+        fill = array('I', bounds)
+        for position, hi in enumerate(his):
+            bucket = hi >> shift
+            order[fill[bucket]] = position
+            fill[bucket] += 1
+        del fill
+
+        self.hi, self.lo, self.accounts = array('Q'), array('Q'), array('I')
+        self.starts = array('I')
+        previous = None
+        for bucket in range(1 << _SORT_BITS):
+            start, end = bounds[bucket], bounds[bucket + 1]
+            if end - start > 1:
+                run = sorted(order[start:end], key=lambda position: (his[position], los[position]))
+            else:
+                run = order[start:end]
+            for position in run:
+                hi, lo = his[position], los[position]
+                if (hi, lo) != previous:
+                    self.starts.append(len(self.accounts))
+                    previous = (hi, lo)
+                self.hi.append(hi)
+                self.lo.append(lo)
+                self.accounts.append(indexes[position])
+        self.starts.append(len(self.accounts))
+
+    def __len__(self):
+        """Number of accounts with a non-blank hash"""
+        return len(self.accounts)
+
+    def unique(self):
+        """Number of distinct non-blank hashes"""
+        return len(self.starts) - 1
+
+    def digest(self, position):
+        return struct.pack(">QQ", self.hi[position], self.lo[position])
+
+    def groups(self):
+        """Yield the account indexes of each distinct hash"""
+        accounts, starts = self.accounts, self.starts
+        for run in range(len(starts) - 1):
+            yield accounts[starts[run]:starts[run + 1]]
+
+    def clusters(self, min_size=2):
+        """Yield (digest, account indexes) for every hash shared by at least min_size accounts"""
+        accounts, starts = self.accounts, self.starts
+        for run in range(len(starts) - 1):
+            start, end = starts[run], starts[run + 1]
+            if end - start >= min_size:
+                yield self.digest(start), accounts[start:end]
+
+    def largest(self, count=10):
+        """Return the count largest clusters as (digest, account indexes), largest first"""
+        return heapq.nlargest(count, self.clusters(), key=lambda cluster: len(cluster[1]))
+
+    def reused(self):
+        """Return (hashes shared by several accounts, accounts using a shared hash)"""
+        hashes = accounts = 0
+        starts = self.starts
+        for run in range(len(starts) - 1):
+            size = starts[run + 1] - starts[run]
+            if size > 1:
+                hashes += 1
+                accounts += size
+        return hashes, accounts
+
+    def accounts_with(self, digest):
+        """Return the account indexes using digest"""
+        hi, lo = struct.unpack(">QQ", digest)
+        start, end = bisect_left(self.hi, hi), bisect_right(self.hi, hi)
+        return [self.accounts[position] for position in range(start, end) if self.lo[position] == lo]
+
+    def unique_per(self, buckets):
+        """Return {bucket: distinct hashes} where buckets maps every account index to a bucket, e.g. a domain"""
+        counts = {}
+        for group in self.groups():
+            if len(group) == 1:
+                bucket = buckets[group[0]]
+                counts[bucket] = counts.get(bucket, 0) + 1
+                continue
+            for bucket in set(buckets[account] for account in group):
+                counts[bucket] = counts.get(bucket, 0) + 1
+        return counts
+
+    def cross_domain(self):
+        """Yield (digest, account indexes) for the shared hashes used in more than one domain"""
+        domain = self.store.domain
+        for digest, group in self.clusters():
+            if len(set(domain[account] for account in group)) > 1:
+                yield digest, group
+
+    def shared_with_cracked(self):
+        """Yield (uncracked account, cracked account) for uncracked accounts whose hash equals that of a
+        cracked account, i.e. whose password is known"""
+        flags = self.store.flags
+        for digest, group in self.clusters():
+            cracked = [account for account in group if flags[account] & CRACKED]
+            if cracked and len(cracked) < len(group):
+                for account in group:
+                    if not flags[account] & CRACKED:
+                        yield account, cracked[0]
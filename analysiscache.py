@@ -0,0 +1,89 @@
+from collections import OrderedDict
+
+from statsgen import analyze_codes, classify, classify_batch
+
+# Distinct passwords kept before the least recently used ones are evicted
+DEFAULT_SIZE = 200000
+
+
+def complexity_flags(codes):
+    """Return (upper, lower, digits, symbols) flags for the class codes of a password.
+
+    These answer the [A-Z], [a-z], \\d and \\W checks of the password policy from the same
+    classification StatsGen uses, so a password is only scanned once.
+    """
+    return ('u' in codes, 'l' in codes, 'd' in codes or 'n' in codes, 's' in codes)
+
+
+class AnalysisCache:
+    """Bounded LRU cache of per-password results shared by the policy checks and StatsGen.
+
+    Each distinct password is classified once while it stays in the cache and both its
+    complexity flags and its StatsGen.analyze_password tuple are derived from that single
+    classification. Dumps where many accounts share a password only pay a dictionary lookup
+    for the duplicates; the hit rate shows how much duplication a dump has.
+    """
+
+    def __init__(self, maxsize=DEFAULT_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # password -> (complexity flags, analyze_password tuple)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _store(self, password, codes):
+        entry = self._entries[password] = (complexity_flags(codes), analyze_codes(codes))
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def lookup(self, password):
+        """Return (complexity flags, analyze_password tuple) of password"""
+        entry = self._entries.get(password)
+        if entry is None:
+            self.misses += 1
+            return self._store(password, classify(password))
+        self.hits += 1
+        self._entries.move_to_end(password)
+        return entry
+
+    def policy(self, password):
+        """Return the complexity flags of password without counting or caching, for checks repeated
+        after the analysis pass such as the weak account metrics"""
+        entry = self._entries.get(password)
+        return entry[0] if entry is not None else complexity_flags(classify(password))
+
+    def analysis(self, password):
+        """Return the StatsGen.analyze_password tuple of password"""
+        return self.lookup(password)[1]
+
+    def analysis_batch(self, passwords, weights=None):
+        """Return the analyze_password tuples of a list of distinct passwords, classifying the misses as
+        one batch. weights gives how many occurrences each password stands for in the hit counts."""
+        entries = []
+        for password in passwords:
+            entry = self._entries.get(password)
+            if entry is not None:
+                self._entries.move_to_end(password)
+            entries.append(entry)
+        missing = [i for i, entry in enumerate(entries) if entry is None]
+        for i, codes in zip(missing, classify_batch([passwords[i] for i in missing])):
+            entries[i] = self._store(passwords[i], codes)
+        self.misses += len(missing)
+        self.hits += (sum(weights) if weights is not None else len(entries)) - len(missing)
+        return [entry[1] for entry in entries]
+
+    def hit_rate(self):
+        """Fraction of lookups answered from the cache"""
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def print_stats(self):
+        """Print cache hit rates"""
+        print("\n[*] Analysis cache:")
+        print("[+] %25s: %02d%% (%d/%d)" % ("hits", self.hit_rate() * 100, self.hits, self.hits + self.misses))
+        print("[+] %25s: %d (%d evicted)" % ("cached passwords", len(self._entries), self.evictions))
@@ -0,0 +1,213 @@
+import argparse
+import contextlib
+import hashlib
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from health import evaluate_password_health, generate_accounts_dict
+from statsgen import StatsGen
+
+SCALES = {"10k": 10000, "1m": 1000000, "10m": 10000000}
+
+# Bump when generate_corpus changes its output, so cached corpora of older generators are not reused
+CORPUS_VERSION = 2
+
+# Passwords drawn from the pool per choices() call
+_DRAW_BATCH = 10000
+
+BLANK_LM = "aad3b435b51404eeaad3b435b51404ee"
+
+DOMAINS = ("ACME.COM", "CORP.ACME.COM", "EU.ACME.COM", "DEV.ACME.COM")
+WORDS = ("password", "welcome", "summer", "winter", "spring", "autumn", "monday", "letmein", "dragon", "football",
+         "monkey", "shadow", "master", "sunshine", "princess", "qwerty", "company", "london", "changeme", "secret")
+NAMES = ("john", "mary", "james", "linda", "robert", "susan", "michael", "karen", "david", "lisa")
+WALKS = ("qwerty", "asdfgh", "zxcvbn", "1qaz2wsx", "qazwsx", "123qwe", "poiuyt")
+SYMBOLS = "!@#$%&*?._-"
+
+
+def _password(rng):
+    """Return (password, human) for one password; most follow a common human pattern, the rest are random"""
+    pattern = rng.random()
+    if pattern < 0.25:
+        word = rng.choice(WORDS)
+        return word.capitalize() + str(rng.randint(0, 99)) + rng.choice(("", "", "!", "1", "#")), True
+    if pattern < 0.45:
+        season = rng.choice(("Summer", "Winter", "Spring", "Autumn", "Fall"))
+        return season + str(rng.randint(2015, 2025)) + rng.choice(("", "!", "@", "#")), True
+    if pattern < 0.60:
+        return rng.choice(NAMES).capitalize() + str(rng.randint(1960, 2010)), True
+    if pattern < 0.70:
+        return rng.choice(WALKS) + rng.choice(("", "1", "!", "123")), True
+    if pattern < 0.80:
+        return rng.choice(WORDS) + str(rng.randint(0, 9999)), True
+    if pattern < 0.87:
+        return str(rng.randint(0, 10 ** rng.randint(4, 8))), True
+    alphabet = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789" + SYMBOLS
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(6, 16))), False
+
+
+def generate_corpus(path, accounts, seed=0):
+    """Write a deterministic synthetic john --show file of DOMAIN\\user:password:RID:LM:NTLM::: lines.
+
+    Passwords are drawn from a pool of about accounts/10 distinct ones with Zipf-like weights, so a
+    few defaults are shared by thousands of accounts like in real corporate dumps.
+    """
+    rng = random.Random(seed)
+    candidates = [_password(rng) for _ in range(max(accounts // 10, 10))]
+    # Random passwords are rarely shared, keep them out of the most frequent ranks
+    pool = [password for password, human in candidates if human] + \
+           [password for password, human in candidates if not human]
+    # Cumulative weights are built once; passing weights to every choices() call would rebuild them per account
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(pool))))
+    with open(path, "w") as out:
+        lines = []
+        for rid in range(accounts):
+            if rid % _DRAW_BATCH == 0:
+                draws = iter(rng.choices(pool, cum_weights=cum_weights, k=min(_DRAW_BATCH, accounts - rid)))
+            password = next(draws)
+            ntlm = hashlib.blake2b(password.encode("utf-8"), digest_size=16).hexdigest()
+            lines.append("%s\\user%d:%s:%d:%s:%s:::\n" % (DOMAINS[rid % len(DOMAINS)], rid, password, 1000 + rid,
+                                                           BLANK_LM, ntlm))
+            if len(lines) >= 10000:
+                out.writelines(lines)
+                lines = []
+        out.writelines(lines)
+
+
+def _run_stages(path):
+    """Run each stage once and return {stage: (wall seconds, cpu seconds, records handled)}"""
+    timings = {}
+    devnull = open(os.devnull, "w")
+
+    def timed(name, func, *args):
+        wall, cpu = time.perf_counter(), time.process_time()
+        with contextlib.redirect_stdout(devnull):
+            result = func(*args)
+        timings[name] = (time.perf_counter() - wall, time.process_time() - cpu)
+        return result
+
+    accounts = timed("generate_accounts_dict", generate_accounts_dict, path)
+    timed("evaluate_password_health", evaluate_password_health, accounts)
+    stats = StatsGen()
+    timed("StatsGen.generate_stats", stats.generate_stats, accounts)
+    timed("StatsGen.print_stats", stats.print_stats)
+    devnull.close()
+
+    # print_stats handles one record per distinct advanced mask, the other stages one per account
+    records = dict((name, len(accounts)) for name in timings)
+    records["StatsGen.print_stats"] = len(stats.stats_advancedmasks)
+    return dict((name, timings[name] + (records[name],)) for name in timings)
+
+
+def _peak_memory(path):
+    """Run the stages again under tracemalloc and return {stage: peak traced bytes}"""
+    peaks = {}
+    devnull = open(os.devnull, "w")
+
+    def traced(name, func, *args):
+        tracemalloc.reset_peak()
+        with contextlib.redirect_stdout(devnull):
+            result = func(*args)
+        peaks[name] = tracemalloc.get_traced_memory()[1]
+        return result
+
+    tracemalloc.start()
+    accounts = traced("generate_accounts_dict", generate_accounts_dict, path)
+    traced("evaluate_password_health", evaluate_password_health, accounts)
+    stats = StatsGen()
+    traced("StatsGen.generate_stats", stats.generate_stats, accounts)
+    traced("StatsGen.print_stats", stats.print_stats)
+    tracemalloc.stop()
+    devnull.close()
+    return peaks
+
+
+def _commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(accounts, seed=0, corpus=None, memory=True):
+    """Benchmark every stage on a synthetic corpus of accounts lines and return the results as a dict"""
+    if corpus is None:
+        corpus = os.path.join(tempfile.gettempdir(), "password_analysis_bench_v%d_%d_%d.txt" %
+                              (CORPUS_VERSION, accounts, seed))
+    if not os.path.exists(corpus):
+        generate_corpus(corpus, accounts, seed)
+
+    timings = _run_stages(corpus)
+    peaks = _peak_memory(corpus) if memory else {}
+    stages = {}
+    for name, (wall, cpu, records) in timings.items():
+        stages[name] = {"seconds": wall,
+                        "cpu_seconds": cpu,
+                        "records": records,
+                        "records_per_second": records / wall if wall else None,
+                        "peak_bytes": peaks.get(name)}
+    return {"commit": _commit(),
+            "python": platform.python_version(),
+            "time": time.time(),
+            "accounts": accounts,
+            "seed": seed,
+            "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "stages": stages}
+
+
+def print_results(results, baseline=None):
+    """Print a results dict, with the speedup over a baseline results dict if given"""
+    print("[*] %d accounts, commit %s, max RSS %.1f MiB" % (results["accounts"], results["commit"],
+                                                            results["max_rss_kib"] / 1024.0))
+    for name, stage in results["stages"].items():
+        line = "[+] %25s: %8.3fs %12.0f rec/s" % (name, stage["seconds"], stage["records_per_second"] or 0)
+        if stage["peak_bytes"] is not None:
+            line += " %8.1f MiB" % (stage["peak_bytes"] / 1048576.0)
+        old = (baseline or {}).get("stages", {}).get(name)
+        if old and stage["seconds"]:
+            line += "  x%.2f vs %s" % (old["seconds"] / stage["seconds"], baseline["commit"])
+        print(line)
+
+
+if __name__ == '__main__':
+    """Benchmark the analysis stages on a synthetic corpus"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--scale', default="10k",
+                        help="Number of accounts, or one of %s. Default is \033[0;0;92m10k\033[0m" % ", ".join(SCALES))
+    parser.add_argument('--seed', default=0, type=int, help="Seed of the synthetic corpus")
+    parser.add_argument('--corpus', type=str, help="Corpus file to use, generated if it does not exist")
+    parser.add_argument('--generate-only', action='store_true', default=False,
+                        help="Only write the corpus file given with --corpus")
+    parser.add_argument('--no-memory', action='store_true', default=False,
+                        help="Skip the tracemalloc run that measures peak memory per stage")
+    parser.add_argument('-o', '--output', type=str, help="Write the results as JSON to this file")
+    parser.add_argument('--compare', type=str, help="JSON results of an earlier run to compare against")
+
+    args = parser.parse_args()
+    accounts = SCALES[args.scale.lower()] if args.scale.lower() in SCALES else int(args.scale)
+
+    if args.generate_only:
+        if not args.corpus:
+            parser.error("--generate-only needs --corpus")
+        generate_corpus(args.corpus, accounts, args.seed)
+        sys.exit(0)
+
+    results = run_benchmark(accounts, args.seed, args.corpus, memory=not args.no_memory)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,163 @@
+import heapq
+import random
+import re
+import zlib
+
+from featureindex import domain_of
+from strength import LEET
+
+# Signature of a base word: BANDS bands of ROWS MinHash values each. Two base words with Jaccard
+# similarity s share a band with probability 1 - (1 - s^ROWS)^BANDS, about 0.66 at s = 0.5 and
+# 0.12 at s = 0.25
+BANDS = 8
+ROWS = 3
+
+# Least Jaccard similarity of the n-grams of a base word and the representative of its family
+THRESHOLD = 0.5
+
+# Characters per n-gram
+NGRAM = 3
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(0x5eed)
+_COEFFICIENTS = [(_rng.randrange(1, _PRIME), _rng.randrange(_PRIME)) for _ in range(BANDS * ROWS)]
+
+# Digits and symbols around the letters of a password, e.g. the 2024! of Summer2024!
+_AFFIXES = re.compile(r'^[^a-z]+|[^a-z]+$')
+# Leetspeak that is part of the word rather than an affix: characters between letters, as in
+# Summ3r or p@$$word, and one leading symbol, as in @dmin; other digits and symbols are affixes.
+# 2 is left alone, it is far more often "to" or part of a keyboard walk such as 1qaz2wsx than a z
+_UNLEET = str.maketrans(dict((c, plain[0]) for c, plain in LEET.items() if c != "2"))
+_LEET = re.compile(r'^[%s](?=[a-z])|(?<=[a-z])[%s]+(?=[a-z])' % (
+    re.escape("".join(c for c in LEET if not c.isdigit())), re.escape("".join(c for c in LEET if c != "2"))))
+
+
+def _unleet(match):
+    return match.group().translate(_UNLEET)
+
+
+def base_word(password):
+    """Return the normalised base word of a password: lower-cased, with leetspeak undone and
+    without leading and trailing digits and symbols, e.g. summer for Summ3r2024! and admin for
+    @dmin123. Passwords without letters have no base word and return ''."""
+    return _AFFIXES.sub('', _LEET.sub(_unleet, password.lower()))
+
+
+def ngrams(word, n=NGRAM):
+    """Return the set of n-grams of word with ^ and $ marking its start and end"""
+    marked = "^%s$" % word
+    return set(marked[i:i + n] for i in range(max(len(marked) - n + 1, 1)))
+
+
+class PasswordFamilies:
+    """Groups cracked passwords into families of variants such as Summer2023!, Summer2024! and Summ3r2024.
+
+    Every distinct password is reduced to its base word, and base words are clustered by the
+    Jaccard similarity of their n-grams with MinHash and locality-sensitive hashing: base words
+    whose signatures agree on a whole band land in the same bucket as candidates. A candidate
+    joins the family of another word of the bucket, kept in a union-find, only if the exact
+    similarity of the two families' representatives reaches the threshold, so families do not
+    chain through words that merely share an affix, like asfcz and guttckfcz. Each step is linear
+    in the number of distinct base words; the MinHash values of an n-gram are computed once and
+    shared by every word containing it.
+    """
+
+    def __init__(self, threshold=THRESHOLD):
+        self.threshold = threshold
+        self.accounts = {}  # password -> account names
+        self._hashes = {}  # n-gram -> MinHash values
+
+    def add(self, username, password):
+        accounts = self.accounts.get(password)
+        if accounts is None:
+            accounts = self.accounts[password] = []
+        accounts.append(username)
+
+    def extend(self, records):
+        """Add (username, password) records while passing them through"""
+        for username, password in records:
+            self.add(username, password)
+            yield username, password
+
+    def signature(self, word):
+        """Return the MinHash signature of the n-grams of word"""
+        hashes = self._hashes
+        values = []
+        for gram in ngrams(word):
+            row = hashes.get(gram)
+            if row is None:
+                x = zlib.crc32(gram.encode("utf-8", "surrogatepass"))
+                row = hashes[gram] = tuple((a * x + b) % _PRIME for a, b in _COEFFICIENTS)
+            values.append(row)
+        return tuple(map(min, zip(*values)))
+
+    def cluster(self):
+        """Return the families as lists of passwords, largest number of accounts first. Passwords
+        without letters are left out."""
+        bases = {}
+        for password in self.accounts:
+            base = base_word(password)
+            if base:
+                bases.setdefault(base, []).append(password)
+        words = list(bases)
+        signatures = [self.signature(word) for word in words]
+        grams = [ngrams(word) for word in words]
+
+        parent = list(range(len(words)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        # The root of a family is its representative, the word around which it was first formed
+        threshold = self.threshold
+        for band in range(BANDS):
+            buckets = {}
+            start = band * ROWS
+            for i, signature in enumerate(signatures):
+                first = buckets.setdefault(signature[start:start + ROWS], i)
+                if first == i:
+                    continue
+                root, other = find(i), find(first)
+                if root != other:
+                    a, b = grams[root], grams[other]
+                    if len(a & b) >= threshold * len(a | b):
+                        parent[root] = other
+
+        families = {}
+        for i, word in enumerate(words):
+            families.setdefault(find(i), []).extend(bases[word])
+        accounts = self.accounts
+        return sorted(families.values(), key=lambda passwords: sum(len(accounts[p]) for p in passwords),
+                      reverse=True)
+
+    def family_accounts(self, passwords):
+        """Return the accounts using one of passwords"""
+        return [username for password in passwords for username in self.accounts[password]]
+
+
+def print_families(families, limit=10, verbose=False, print_password=False):
+    """Print how many accounts use variants of the same password and the largest families"""
+    clusters = families.cluster()
+    variants = [passwords for passwords in clusters if len(passwords) > 1]
+    print("\n[*] Password families:")
+    print("[+] %25s: %d" % ("distinct passwords", len(families.accounts)))
+    print("[+] %25s: %d" % ("families of variants", len(variants)))
+    print("[+] %25s: %d" % ("accounts in a family", sum(len(families.family_accounts(passwords))
+                                                        for passwords in variants)))
+
+    print("\n[*] Largest password families:")
+    accounts = families.accounts
+    for number, passwords in enumerate(variants[:limit], 1):
+        users = families.family_accounts(passwords)
+        domains = sorted(set(domain_of(username) or "local" for username in users))
+        if print_password:
+            common = heapq.nlargest(3, passwords, key=lambda password: len(accounts[password]))
+            label = ", ".join(common)
+        else:
+            label = "family %d" % number
+        print("[+] %25s: %d accounts, %d passwords in %s" % (label, len(users), len(passwords), ", ".join(domains)))
+        if verbose:
+            print("\t" + ", ".join(users))
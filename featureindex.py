@@ -0,0 +1,321 @@
+import argparse
+import fnmatch
+import json
+import os
+import struct
+import sys
+import time
+from array import array
+
+from statsgen import CHARSETS, StatsGen, analyze_codes
+from strength import SCORE_LABELS
+
+MAGIC = b"PWHFEAT1"
+VERSION = 1
+
+NO_SCORE = 255
+
+# Columns of the mask table, one entry per distinct advanced mask
+MASK_COLUMNS = (("length", "H"), ("charset", "B"), ("simplemask", "B"),
+                ("digit", "H"), ("lower", "H"), ("upper", "H"), ("special", "H"))
+
+# Columns of the rows, one per distinct (mask, domain, in wordlist, strength score, policy pass bits)
+ROW_COLUMNS = (("mask", "I"), ("domain", "I"), ("listed", "B"), ("score", "B"), ("passed", "I"), ("count", "I"))
+
+# Policies whose pass bits fit the passed column
+MAX_POLICIES = 32
+
+GROUPS = ("length", "charset", "simplemask", "mask", "domain", "listed", "score", "policy")
+
+
+def domain_of(username):
+    """Return the upper-cased domain of a DOMAIN\\user name, '' without a domain"""
+    return username.rpartition("\\")[0].upper()
+
+
+class FeatureWriter:
+    """Collects the features of every analysed account for a FeatureIndex.
+
+    Accounts with the same advanced mask, domain, wordlist and strength result and policy outcome
+    only differ in their count, so they are aggregated into one row while the run goes.
+    """
+
+    def __init__(self, policies=()):
+        if len(policies) > MAX_POLICIES:
+            raise ValueError("at most %d policies can be recorded, got %d" % (MAX_POLICIES, len(policies)))
+        self.policies = list(policies)
+        self.accounts = 0
+        self.masks = {}  # advanced mask -> id
+        self.analyses = []
+        self.domains = {}  # domain -> id
+        self.rows = {}  # (mask id, domain id, listed, score, pass bits) -> accounts
+
+    def add(self, username, analysis, listed=False, score=None, passed=0):
+        """Count one account with the analysis of its password, see evaluate_password_health. Empty
+        passwords are skipped like in the statistics."""
+        if not analysis[0]:
+            return
+        mask = self.masks.get(analysis[3])
+        if mask is None:
+            mask = self.masks[analysis[3]] = len(self.analyses)
+            self.analyses.append(analysis)
+        domain = domain_of(username)
+        domain_id = self.domains.get(domain)
+        if domain_id is None:
+            domain_id = self.domains[domain] = len(self.domains)
+        key = (mask, domain_id, 1 if listed else 0, NO_SCORE if score is None else score, passed)
+        self.rows[key] = self.rows.get(key, 0) + 1
+        self.accounts += 1
+
+    def save(self, path):
+        """Write the features to path, replacing it atomically"""
+        charsets = sorted(set(analysis[1] for analysis in self.analyses))
+        simplemasks = sorted(set(analysis[2] for analysis in self.analyses))
+        charset_ids = dict((name, i) for i, name in enumerate(charsets))
+        simplemask_ids = dict((name, i) for i, name in enumerate(simplemasks))
+
+        classes = list(zip(*[analysis[4] for analysis in self.analyses])) or [()] * 4
+        values = [[analysis[0] for analysis in self.analyses],
+                  [charset_ids[analysis[1]] for analysis in self.analyses],
+                  [simplemask_ids[analysis[2]] for analysis in self.analyses]] + classes
+        columns = [(name, array(typecode, column)) for (name, typecode), column in zip(MASK_COLUMNS, values)]
+        rows = list(self.rows.items())
+        for position, (name, typecode) in enumerate(ROW_COLUMNS[:-1]):
+            columns.append((name, array(typecode, [key[position] for key, count in rows])))
+        columns.append(("count", array("I", [count for key, count in rows])))
+
+        header = {"version": VERSION,
+                  "created": time.time(),
+                  "accounts": self.accounts,
+                  "policies": [policy.name for policy in self.policies],
+                  "byteorder": sys.byteorder,
+                  "charsets": charsets,
+                  "simplemasks": simplemasks,
+                  "masks": sorted(self.masks, key=self.masks.get),
+                  "domains": sorted(self.domains, key=self.domains.get),
+                  "columns": [[name, column.typecode, len(column)] for name, column in columns]}
+        data = json.dumps(header).encode("utf-8")
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack(">I", len(data)))
+            f.write(data)
+            for name, column in columns:
+                column.tofile(f)
+        os.replace(tmp, path)
+
+
+class FeatureIndex:
+    """Filtered counts and statistics over a feature file written by FeatureWriter.save.
+
+    Predicates on the mask features (length, character-set, simple mask, class counts, mask
+    pattern) and on the domain are first evaluated once per distinct mask and domain; only the
+    small row columns are then scanned, so a query touches each row once whatever it filters on.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            data = f.read()
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s is not a feature index, write one with health.py --features" % path)
+        (size,) = struct.unpack_from(">I", data, len(MAGIC))
+        start = len(MAGIC) + 4
+        header = json.loads(data[start:start + size].decode("utf-8"))
+        if header["version"] != VERSION:
+            raise ValueError("%s has unsupported feature index version %s" % (path, header["version"]))
+        self.created = header["created"]
+        self.accounts = header["accounts"]
+        self.policies = header["policies"]
+        self.charsets = header["charsets"]
+        self.simplemasks = header["simplemasks"]
+        self.masks = header["masks"]
+        self.domains = header["domains"]
+        self.columns = {}
+        position = start + size
+        for name, typecode, length in header["columns"]:
+            column = array(typecode)
+            column.frombytes(data[position:position + column.itemsize * length])
+            if header["byteorder"] != sys.byteorder:
+                column.byteswap()
+            self.columns[name] = column
+            position += column.itemsize * length
+        self.rows = len(self.columns["count"])
+
+    def _mask_filter(self, minlength=None, maxlength=None, charsets=None, simplemasks=None, masks=None,
+                     min_classes=None):
+        """Return a bytearray marking the mask ids that pass the mask predicates, None if there are none"""
+        if minlength is None and maxlength is None and charsets is None and simplemasks is None and \
+                masks is None and min_classes is None:
+            return None
+        length = self.columns["length"]
+        ok = bytearray(b"\1") * len(self.masks)
+        if minlength is not None or maxlength is not None:
+            low = minlength if minlength is not None else 0
+            high = maxlength if maxlength is not None else float("inf")
+            ok = bytearray(o and low <= n <= high for o, n in zip(ok, length))
+        if charsets is not None:
+            wanted = set(i for i, name in enumerate(self.charsets) if name in charsets)
+            ok = bytearray(o and c in wanted for o, c in zip(ok, self.columns["charset"]))
+        if simplemasks is not None:
+            wanted = set(i for i, name in enumerate(self.simplemasks) if name in simplemasks)
+            ok = bytearray(o and s in wanted for o, s in zip(ok, self.columns["simplemask"]))
+        if min_classes is not None:
+            classes = [(d > 0) + (l > 0) + (u > 0) + (s > 0) for d, l, u, s in
+                       zip(self.columns["digit"], self.columns["lower"], self.columns["upper"],
+                           self.columns["special"])]
+            ok = bytearray(o and c >= min_classes for o, c in zip(ok, classes))
+        if masks is not None:
+            ok = bytearray(o and any(fnmatch.fnmatchcase(mask, pattern) for pattern in masks)
+                           for o, mask in zip(ok, self.masks))
+        return ok
+
+    def select(self, minlength=None, maxlength=None, charsets=None, simplemasks=None, masks=None, min_classes=None,
+               domains=None, listed=None, min_score=None, max_score=None, failed=None, breached=None):
+        """Return the positions of the rows matching every given predicate.
+
+        masks and domains are lists of shell-style patterns (domains match case-insensitively),
+        listed is True or False for passwords found or not found in the wordlist, failed is the
+        name of a policy the accounts fail and breached is True for accounts failing at least one
+        policy, False for accounts passing all of them.
+        """
+        rows = range(self.rows)
+        mask_ok = self._mask_filter(minlength, maxlength, charsets, simplemasks, masks, min_classes)
+        if mask_ok is not None:
+            column = self.columns["mask"]
+            rows = [i for i in rows if mask_ok[column[i]]]
+        if domains is not None:
+            patterns = [pattern.upper() for pattern in domains]
+            domain_ok = bytearray(any(fnmatch.fnmatchcase(domain, pattern) for pattern in patterns)
+                                  for domain in self.domains)
+            column = self.columns["domain"]
+            rows = [i for i in rows if domain_ok[column[i]]]
+        if listed is not None:
+            column = self.columns["listed"]
+            rows = [i for i in rows if column[i] == listed]
+        if min_score is not None or max_score is not None:
+            low = min_score if min_score is not None else 0
+            high = max_score if max_score is not None else NO_SCORE - 1
+            column = self.columns["score"]
+            rows = [i for i in rows if low <= column[i] <= high]
+        if failed is not None or breached is not None:
+            column = self.columns["passed"]
+            everything = (1 << len(self.policies)) - 1
+            if failed is not None:
+                if failed not in self.policies:
+                    raise ValueError("no policy %s in %s, it has %s" % (failed, self.path, ", ".join(self.policies)))
+                bit = 1 << self.policies.index(failed)
+                rows = [i for i in rows if not column[i] & bit]
+            if breached is not None:
+                rows = [i for i in rows if (column[i] != everything) == breached]
+        return rows
+
+    def count(self, rows):
+        """Return the number of accounts in rows"""
+        column = self.columns["count"]
+        return sum(column[i] for i in rows)
+
+    def group(self, rows, by):
+        """Return {value: accounts} of rows grouped by one of GROUPS. Grouped by policy, every account
+        counts once for each policy it fails."""
+        counts = self.columns["count"]
+        totals = {}
+        if by == "policy":
+            column = self.columns["passed"]
+            for i in rows:
+                for bit, name in enumerate(self.policies):
+                    if not column[i] & (1 << bit):
+                        totals[name] = totals.get(name, 0) + counts[i]
+            return totals
+        if by in ("domain", "listed", "score", "mask"):
+            column = self.columns[by]
+            for i in rows:
+                totals[column[i]] = totals.get(column[i], 0) + counts[i]
+            if by == "domain":
+                return dict((self.domains[key] or "(none)", count) for key, count in totals.items())
+            if by == "listed":
+                return dict(("in wordlist" if key else "not in wordlist", count) for key, count in totals.items())
+            if by == "score":
+                return dict((SCORE_LABELS[key] if key != NO_SCORE else "not scored", count)
+                            for key, count in totals.items())
+            return dict((self.masks[key], count) for key, count in totals.items())
+        # Mask features are looked up through the mask of the row
+        mask = self.columns["mask"]
+        for i in rows:
+            totals[mask[i]] = totals.get(mask[i], 0) + counts[i]
+        column = self.columns[by]
+        names = {"charset": self.charsets, "simplemask": self.simplemasks}.get(by)
+        grouped = {}
+        for key, count in totals.items():
+            value = names[column[key]] if names is not None else column[key]
+            grouped[value] = grouped.get(value, 0) + count
+        return grouped
+
+    def stats(self, rows):
+        """Return a StatsGen of the accounts in rows, as health.py -M would print it"""
+        stats = StatsGen()
+        mask = self.columns["mask"]
+        listed = self.columns["listed"]
+        score = self.columns["score"]
+        counts = self.columns["count"]
+        analyses = {}
+        for i in rows:
+            analysis = analyses.get(mask[i])
+            if analysis is None:
+                analysis = analyses[mask[i]] = analyze_codes(self.masks[mask[i]][1::2])
+            stats.add_analysis(analysis, counts[i], listed=bool(listed[i]),
+                               score=score[i] if score[i] != NO_SCORE else None)
+        return stats
+
+
+def print_groups(grouped, total, by, limit=None):
+    """Print grouped counts, largest first"""
+    print("\n[*] By %s:" % by)
+    for (value, count) in sorted(grouped.items(), key=lambda item: item[1], reverse=True)[:limit]:
+        print("[+] %25s: %02d%% (%d)" % (value, count * 100 // total if total else 0, count))
+
+
+if __name__ == '__main__':
+    """Query a feature index written by health.py --features"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('index', help="Feature index written by health.py --features")
+    parser.add_argument('--minlength', type=int, help="Only passwords at least this long")
+    parser.add_argument('--maxlength', type=int, help="Only passwords at most this long")
+    parser.add_argument('--charset', nargs='+', choices=CHARSETS, help="Only passwords of these character-sets")
+    parser.add_argument('--simplemask', nargs='+', help="Only passwords of these simple masks, e.g. stringdigit")
+    parser.add_argument('--mask', nargs='+', help="Only passwords whose advanced mask matches one of these patterns, "
+                                                  "e.g. '?u?l*?d?d'")
+    parser.add_argument('--min-classes', type=int, help="Only passwords with at least this many character classes")
+    parser.add_argument('--domain', nargs='+', help="Only accounts of these domains, patterns like 'EU.*' allowed")
+    parser.add_argument('--listed', choices=("yes", "no"), help="Only passwords found (or not) in the wordlist")
+    parser.add_argument('--min-score', type=int, help="Only passwords with at least this strength score")
+    parser.add_argument('--max-score', type=int, help="Only passwords with at most this strength score")
+    parser.add_argument('--failed', help="Only accounts failing this policy")
+    parser.add_argument('--breached', choices=("yes", "no"),
+                        help="Only accounts failing at least one policy (yes) or passing all of them (no)")
+    parser.add_argument('--group-by', nargs='+', choices=GROUPS, default=[],
+                        help="Print the matching accounts grouped by these features")
+    parser.add_argument('--limit', default=20, type=int,
+                        help="Groups printed per feature. Default is \033[0;0;92m20\033[0m")
+    parser.add_argument('--stats', action='store_true', default=False,
+                        help="Print the full statistics of the matching accounts")
+
+    args = parser.parse_args()
+    index = FeatureIndex(args.index)
+    started = time.perf_counter()
+    try:
+        rows = index.select(minlength=args.minlength, maxlength=args.maxlength, charsets=args.charset,
+                            simplemasks=args.simplemask, masks=args.mask, min_classes=args.min_classes,
+                            domains=args.domain, listed=None if args.listed is None else args.listed == "yes",
+                            min_score=args.min_score, max_score=args.max_score, failed=args.failed,
+                            breached=None if args.breached is None else args.breached == "yes")
+    except ValueError as e:
+        parser.error(str(e))
+    matched = index.count(rows)
+    print("[*] %d of %d accounts match (%d of %d rows) in %.1fms" % (
+        matched, index.accounts, len(rows), index.rows, (time.perf_counter() - started) * 1000))
+    for by in args.group_by:
+        print_groups(index.group(rows, by), matched, by, args.limit)
+    if args.stats and matched:
+        print("")
+        index.stats(rows).print_stats()
@@ -1,144 +1,178 @@
 import argparse
 import csv
+from array import array
 
 import os
 import re
 
-from statsgen import StatsGen
+from accountstore import (AccountStore, BLANK_LM, BLANK_NTLM, CRACKED, ENABLED, HAS_LM, HAS_NTLM, HashIndex,
+                          MACHINE, NO_DOMAIN)
+from analysiscache import AnalysisCache
+from families import THRESHOLD, PasswordFamilies, print_families
+from featureindex import FeatureWriter
+from ingest import CONFLICT_RULES, expand_inputs, merge_inputs
+from maskgen import HASHRATE, TIME_BUDGET, format_duration, parse_duration, parse_hashrate, print_selection, \
+    select_masks, write_hcmask
+from policy import CLASS_LABELS, TOO_LONG, TOO_SHORT, PolicySet, resolve_policies
+from potfile import iter_cracked, iter_john_lines, iter_john_records, unique_records
+from profiling import NULL_PROFILER, Profiler
+from reporters import CONSOLE, FIELDNAMES, ConsoleReporter, CsvReporter, JsonLinesReporter, MultiReporter
+from sketches import capacity_for_memory
+from snapshot import Snapshot
+from statsgen import CHARSETS, StatsGen, analyze_codes, classify
+from strength import load_estimator
+from wordlist import WordlistIndex
 from pprint import pprint
 import csv
 
+# rules_dict key of each missing class label
+CLASS_KEYS = dict(zip(CLASS_LABELS, ("Capital", "Lower", "Digits", "Symbols")))
+
+
 def generate_accounts_dict(john):
     """Generate a dictionary object containing user account information and weak passwords"""
-    users = {}
     # Read in cracked password from John output and update user object in dictionary
-    jlines = john.read().splitlines()
-    for j in jlines:
-        if ":" in j:
-            if not j.split(":")[0].endswith("$"):  # Eliminate machine hashes
-                # print "%s : %s" % (j.split(":")[0], j.split(":")[1])
-                users[j.split(":")[0]] = j.split(":")[1]
-    return users
-
-
-def evaluate_password_health(users, print_password=False):
-    """Evaluate the health of the passed in dictionary of accounts"""
-    hasUpperCase = "[A-Z]"
-    hasLowerCase = "[a-z]"
-    hasNumbers = "\d"
-    hasNonalphas = "\W"
-    results = []
-    for username, password in users.items():
-        # print("testing: %s:%s" % (username, password))
+    return dict(iter_john_records(john, unique=False))
+
+
+def evaluate_password_health(users, print_password=False, cache=None, stats=None, snapshot=None, reporter=None,
+                             policies=None, wordlist=None, strength=None, features=None):
+    """Evaluate the health of the passed in dictionary of accounts or iterable of (username, password) records
+    against a PolicySet, by default the legacy AD policy. Every account failing one of the policies is passed to
+    reporter, by default a ConsoleReporter printing them, and the number of breaching accounts is returned. If a
+    StatsGen is passed in, the same pass adds every password to it, so the policy checks and the statistics come
+    from a single classification of each password. If a Snapshot is passed in, the result of every account is
+    recorded in it. With a WordlistIndex, passwords found in it fail the policies with a blocklist rule. With a
+    strength Estimator, every rules_dict gets the password's Strength score. With a featureindex.FeatureWriter,
+    the features and policy outcome of every account are collected for later queries"""
+    if cache is None:
+        cache = AnalysisCache()
+    if policies is None:
+        policies = PolicySet(resolve_policies(["legacy-ad"]))
+    own_reporter = reporter is None
+    if own_reporter:
+        reporter = ConsoleReporter()
+    breaches = 0
+    records = users.items() if hasattr(users, "items") else users
+    for username, password in records:
+        (flags, analysis) = cache.lookup(password)
+        listed = wordlist is not None and password in wordlist
+        score = strength.score(password) if strength is not None else None
+        if stats is not None and password:
+            stats.add_analysis(analysis, password=password, listed=listed, score=score)
+
         if print_password:
             printable_pass = password
         else:
             printable_pass = ""
 
         rules_dict = {"username":username,"password":printable_pass,"Length":1,"Capital":1,"Lower":1,"Digits":1,"Symbols":1}
-
-        if len(password) < 8:
-            print("Policy breach, too short : %s %s" % (username, printable_pass))
-            rules_dict["Length"] = "0"
-
-        elif len(password) > 8:
-            # print("larger than 8")
-            # raw_input('asdfasdf')
-            breakRules = []
-            score = 0;
-            bestCase = 4
-            # pprint(re.search(hasUpperCase, password))
-
-            if not re.search(hasUpperCase, password):
-                   breakRules.append("no upper case")
-                   rules_dict["Capital"] = 0
-            # print("upper")
-            if not re.search(hasLowerCase, password):
-                breakRules.append("no lower case")
-                rules_dict["Lower"] = 0
-            # print("lower")
-
-            if not re.search(hasNumbers, password):
-                breakRules.append("no numbers")
-                rules_dict["Digits"] = 0
-
-            # print("numbers")
-
-            if not re.search(hasNonalphas, password):
-                breakRules.append("non symbols")
-                rules_dict["Symbols"] = 0
-
-            # print("nonalphas")
-
-            score = bestCase - len(breakRules)
-
-            # print("%s score %s "%(password,score))  
-            # raw_input('asdfasdf')
-            if score <3:
-                print("================\nPolicy breach: %s:%s %s " % (username, printable_pass, score ))
-
-                for el in breakRules:
-                    print("Broken Rule: %s"%el)
-
-                print("================")
-                results.append(rules_dict)
-    return results
-   
-def generate_metrics(users):
-    """Generate metrics from passed in dictionary of users"""
+        if score is not None:
+            rules_dict["Strength"] = score
+        bits = policies.evaluate(len(password), flags, listed)
+        breached = bits != policies.all
+
+        if breached:
+            breaches += 1
+            failed = policies.names(policies.all & ~bits)
+            breakRules = policies.broken_rules(len(password), flags, bits, listed)
+            for label in breakRules:
+                if label in (TOO_SHORT, TOO_LONG):
+                    rules_dict["Length"] = "0"
+                elif label in CLASS_KEYS:
+                    rules_dict[CLASS_KEYS[label]] = 0
+            # A breach of the length rule alone keeps its one-line report without a score
+            length_only = len(breakRules) == 1 and breakRules[0] in (TOO_SHORT, TOO_LONG)
+            reporter.breach(rules_dict, breakRules, None if length_only else sum(flags), failed)
+
+        if snapshot is not None:
+            snapshot.record(username, rules_dict, breached, analysis, listed, score, breakRules if breached else ())
+        if features is not None:
+            features.add(username, analysis, listed, score, bits)
+    if own_reporter:
+        reporter.close()
+    return breaches
+
+
+def is_weak(password, cache, policies=None, wordlist=None):
+    """Return True if password breaches one of the policies checked by evaluate_password_health"""
+    if policies is None:
+        policies = PolicySet(resolve_policies(["legacy-ad"]))
+    return not policies.passes(password, cache, wordlist)
+
+
+def generate_metrics(store, weak=None, output=None, verbose=False, lm_index=None, ntlm_index=None):
+    """Generate metrics from an AccountStore. weak is a function telling if a cracked password is weak.
+    Unique hash counts come from HashIndexes of the store, which are built if not passed in"""
 
     # Generate Metrics
-    uc = 0  # User Accounts
-    mc = 0  # Machine Accounts
-    metrics = {}  # metrics[<domain>][keys]; local and machine always exist
+    metrics = {}  # metrics[<domain>][keys]
+    names = []  # domain of each bucket id
+    buckets = array('I')  # bucket id of each account
 
-    for u in users:
-        if users[u].get('type') == 'machine':
+    for u in range(len(store)):
+        flags = store.flags[u]
+        if flags & MACHINE:
             d = 'machine'
-        elif users[u].get('domain') is None:
+        elif store.domain[u] == NO_DOMAIN:
             d = 'local'
         else:
-            d = users[u].get('domain').lower()
+            d = store.domains[store.domain[u]].lower()
 
-        if d not in metrics.keys():  # Create "not" value by subtracting from total accounts
-            metrics[d] = {'accounts': 0,
+        if d not in metrics:  # Create "not" value by subtracting from total accounts
+            metrics[d] = {'id': len(names),
+                          'accounts': 0,
                           'crackedAccounts': 0,
                           'weakAccounts': 0,
                           'enabledAccounts': 0,
-                          'lmHashes': [],
-                          'ntlmHashes': [],
+                          'lmHashes': 0,
+                          'ntlmHashes': 0,
                           'blankLM': 0,
                           'blankNTLM': 0
                           }
+            names.append(d)
+        m = metrics[d]
+        buckets.append(m['id'])
 
         # Count accounts
-        metrics[d]['accounts'] += 1
+        m['accounts'] += 1
 
         # Count cracked accounts
-        if users[u].get('cracked') is not None:
-            metrics[d]['crackedAccounts'] += 1
+        if flags & CRACKED:
+            m['crackedAccounts'] += 1
 
-        # Count weak accounts
-        if users[u].get('weak') != "Not Cracked" and users[u].get('weak') != "Cracked":
-            metrics[d]['weakAccounts'] += 1
+            # Count weak accounts
+            if weak is not None and weak(store.passwords[u]):
+                m['weakAccounts'] += 1
 
         # Count enabled accounts
-        if users[u].get('enabled') == 'Enabled':
-            metrics[d]['enabledAccounts'] += 1
-
-        # Add LM hashes
-        if users[u].get('lm').lower() != "aad3b435b51404eeaad3b435b51404ee":
-            metrics[d]['lmHashes'].append(users[u].get('lm').lower())
-        elif users[u].get('lm').lower() == "aad3b435b51404eeaad3b435b51404ee":
-            metrics[d]['blankLM'] += 1
-
-        # Add NTLM hashes
-        if users[u].get('ntlm').lower() != "31d6cfe0d16ae931b73c59d7e0c089c0":
-            metrics[d]['ntlmHashes'].append(users[u].get('ntlm').lower())
-        elif users[u].get('ntlm').lower() == "31d6cfe0d16ae931b73c59d7e0c089c0":
-            metrics[d]['blankNTLM'] += 1
-
-    print("Total Accounts:\t%s" % len(users))
+        if flags & ENABLED:
+            m['enabledAccounts'] += 1
+
+        # Count LM and NTLM hashes, blank ones separately
+        if flags & HAS_LM:
+            if store.lm[u * 16:u * 16 + 16] != BLANK_LM:
+                m['lmHashes'] += 1
+            else:
+                m['blankLM'] += 1
+        if flags & HAS_NTLM:
+            if store.ntlm[u * 16:u * 16 + 16] != BLANK_NTLM:
+                m['ntlmHashes'] += 1
+            else:
+                m['blankNTLM'] += 1
+
+    # Distinct hashes per domain, from one sorted index per hash type
+    if lm_index is None:
+        lm_index = HashIndex(store, "lm")
+    if ntlm_index is None:
+        ntlm_index = HashIndex(store, "ntlm")
+    unique_lm = lm_index.unique_per(buckets)
+    unique_ntlm = ntlm_index.unique_per(buckets)
+    for d, m in metrics.items():
+        m['uniqueLM'] = unique_lm.get(m['id'], 0)
+        m['uniqueNTLM'] = unique_ntlm.get(m['id'], 0)
+
+    print("Total Accounts:\t%s" % len(store))
 
     a = 0  # Accounts
     c = 0  # Cracked
@@ -156,13 +190,13 @@ def generate_metrics(users):
         c += metrics[m]['crackedAccounts']
         w += metrics[m]['weakAccounts']
         e += metrics[m]['enabledAccounts']
-        lm += len(metrics[m]['lmHashes'])
-        nt += len(metrics[m]['ntlmHashes'])
+        lm += metrics[m]['lmHashes']
+        nt += metrics[m]['ntlmHashes']
         bl += metrics[m]['blankLM']
         bn += metrics[m]['blankNTLM']
-        ul += len(set(metrics[m]['lmHashes']))
-        un += len(set(metrics[m]['ntlmHashes']))
-        if VERBOSE:
+        ul += metrics[m]['uniqueLM']
+        un += metrics[m]['uniqueNTLM']
+        if verbose:
             print("%s" % m)
             print("\t" + "Accounts:\t\t\t%d" % metrics[m]['accounts'])
             print("\t" + "Cracked Accounts:\t\t%d" % metrics[m]['crackedAccounts'])
@@ -171,15 +205,15 @@ def generate_metrics(users):
             print("\t" + "Not Weak Accounts:\t\t%d" % (metrics[m]['accounts'] - metrics[m]['weakAccounts']))
             print("\t" + "Enabled Accounts:\t\t%d" % metrics[m]['enabledAccounts'])
             print("\t" + "Disabled Accounts:\t\t%d" % (metrics[m]['accounts'] - metrics[m]['enabledAccounts']))
-            print("\t" + "Total LM Hashes:\t\t%d" % len(metrics[m]['lmHashes']))
-            print("\t" + "Total NTLM Hashes:\t\t%d" % len(metrics[m]['ntlmHashes']))
+            print("\t" + "Total LM Hashes:\t\t%d" % metrics[m]['lmHashes'])
+            print("\t" + "Total NTLM Hashes:\t\t%d" % metrics[m]['ntlmHashes'])
             print("\t" + "Total Blank LM Hashes:\t%d" % metrics[m]['blankLM'])
             print("\t" + "Total Blank NTLM Hashes:\t%d" % metrics[m]['blankNTLM'])
-            print("\t" + "Total Unique LM Hashes:\t%d" % len(set(metrics[m]['lmHashes'])))
-            print("\t" + "Total Unique NTLM Hashes:\t%d" % len(set(metrics[m]['ntlmHashes'])))
+            print("\t" + "Total Unique LM Hashes:\t%d" % metrics[m]['uniqueLM'])
+            print("\t" + "Total Unique NTLM Hashes:\t%d" % metrics[m]['uniqueNTLM'])
 
-    if args.output:
-        with open(os.path.join(args.output, "ADPassHealth-Metrics.csv"), 'wb') as csv_file:
+    if output:
+        with open(os.path.join(output, "ADPassHealth-Metrics.csv"), 'w', newline='') as csv_file:
             writer = csv.writer(csv_file)
             writer.writerow(["", "Accounts", "LM", "NTLM", "Unique LM", "Unique NTLM", "Cracked",
                              "Blank LM", "Blank NTLM", "Weak", "Not Weak", "Enabled", "Disabled",
@@ -187,10 +221,10 @@ def generate_metrics(users):
             for m in metrics:
                 writer.writerow([m,
                                  metrics[m]['accounts'],
-                                 len(metrics[m]['lmHashes']),
-                                 len(metrics[m]['ntlmHashes']),
-                                 len(set(metrics[m]['lmHashes'])),
-                                 len(set(metrics[m]['ntlmHashes'])),
+                                 metrics[m]['lmHashes'],
+                                 metrics[m]['ntlmHashes'],
+                                 metrics[m]['uniqueLM'],
+                                 metrics[m]['uniqueNTLM'],
                                  metrics[m]['crackedAccounts'],  # TODO Update this to just account for LM
                                  metrics[m]['blankLM'],
                                  metrics[m]['blankNTLM'],
@@ -208,7 +242,7 @@ def generate_metrics(users):
                              "%.2f%%" % (float(c) / float(a) * 100), "%.2f%%" % (float(e) / float(a) * 100)])
             csv_file.close()
 
-    if VERBOSE:
+    if verbose:
         print("Grand Total")
         print("\t" + "Accounts:\t\t\t%d" % a)
         print("\t" + "Cracked Accounts:\t\t%d" % c)
@@ -223,58 +257,350 @@ def generate_metrics(users):
         print("\t" + "Total Blank NTLM Hashes:\t%d" % bn)
         print("\t" + "Total Unique LM Hashes:\t%d" % ul)
         print("\t" + "Total Unique NTLM Hashes:\t%d" % un)
+    return lm_index, ntlm_index
+
+
+def _account_name(store, index):
+    domain = store.domain_name(index)
+    return "%s\\%s" % (domain, store.usernames[index]) if domain else store.usernames[index]
+
+
+def print_reuse(store, index, limit=10, verbose=False, print_password=False):
+    """Print password reuse found through a HashIndex: shared hashes, the largest clusters, reuse across
+    domains and uncracked accounts whose password is known because a cracked account has the same hash"""
+    reused, sharing = index.reused()
+    print("\n[*] %s hash reuse:" % index.column.upper())
+    print("[+] %25s: %d" % ("hashes", len(index)))
+    print("[+] %25s: %d" % ("unique hashes", index.unique()))
+    print("[+] %25s: %d" % ("blank hashes", index.blank))
+    print("[+] %25s: %d" % ("shared hashes", reused))
+    print("[+] %25s: %d" % ("accounts sharing a hash", sharing))
+
+    print("\n[*] Largest reuse clusters:")
+    flags = store.flags
+    for digest, group in index.largest(limit):
+        domains = sorted(set(store.domain_name(account) or "local" for account in group))
+        cracked = [account for account in group if flags[account] & CRACKED]
+        label = store.passwords[cracked[0]] if cracked and print_password else digest.hex()
+        print("[+] %25s: %d accounts in %s" % (label, len(group), ", ".join(domains)))
+        if verbose:
+            print("\t" + ", ".join(_account_name(store, account) for account in group))
+
+    cross = 0
+    for digest, group in index.cross_domain():
+        cross += 1
+    print("[+] %25s: %d" % ("shared across domains", cross))
+
+    known = 0
+    for account, cracked in index.shared_with_cracked():
+        known += 1
+        if verbose:
+            password = store.passwords[cracked] if print_password else ""
+            print("Uncracked, same hash as %s : %s %s" % (_account_name(store, cracked),
+                                                          _account_name(store, account), password))
+    print("[+] %25s: %d" % ("uncracked with known hash", known))
 
 
 if __name__ == '__main__':
     """Main function to run as script"""
     parser = argparse.ArgumentParser()
-    parser.add_argument('-J', '--john', type=argparse.FileType('r'), required=True,
-                        help="A file with the output from John using the --show flag or hashes in this format "
+    parser.add_argument('-J', '--john', required=True, nargs='+',
+                        help="Files with the output from John using the --show flag or hashes in this format "
                              "\033[0;0;92mACME.COM\\john:crackedPassword:RID:LMHash:NTLMHash::: (pwdLastSet) "
-                             "(status)\033[0m. The pwdLastSet and status parts are optional.")
+                             "(status)\033[0m. The pwdLastSet and status parts are optional. gzip, bz2 and xz "
+                             "files are read directly, use - to read from stdin. Glob patterns and directories are "
+                             "expanded; several inputs are read concurrently and merged into one record per account.")
+    parser.add_argument('--pot', nargs='+', default=[],
+                        help="hashcat potfiles of NTLM:password lines used to crack accounts of the -J inputs")
+    parser.add_argument('--conflict', default="first", choices=CONFLICT_RULES,
+                        help="Record kept when several inputs have the same DOMAIN\\user: the first or last one given, "
+                             "or the first cracked one. Default is \033[0;0;92mfirst\033[0m")
+    parser.add_argument('--mmap', action='store_true', default=False,
+                        help="Memory-map plain (uncompressed) input files while reading them")
     parser.add_argument('-N', '--number', default=8, type=int,
                         help="Find all instances where the cracked password is less than the passed in number. Default "
                              "is \033[0;0;92m8\033[0m")
+    parser.add_argument('--policy', nargs='+',
+                        help="Password policies to audit against in one pass: built-in \033[0;0;92mlegacy-ad\033[0m "
+                             "(-N characters and 3 of 4 character classes), \033[0;0;92mad-14\033[0m and "
+                             "\033[0;0;92mnist-800-63b\033[0m, or JSON files of policy definitions with name, "
+                             "min_length, max_length, min_classes and require. Default is legacy-ad")
+    parser.add_argument('--wordlist', type=str,
+                        help="Index of common or breached passwords built with wordlist.py. Cracked passwords found in "
+                             "it are counted in the statistics and fail policies with a blocklist rule, such as "
+                             "nist-800-63b")
+    parser.add_argument('--strength', action='store_true', default=False,
+                        help="Estimate how guessable every cracked password is (dictionary words, leetspeak, keyboard "
+                             "walks, sequences, repeats and dates), add the 0-4 score to the breach reports and a "
+                             "histogram to the statistics")
+    parser.add_argument('--strength-words', type=str,
+                        help="Ranked words for --strength, one per line with the most common first, instead of the "
+                             "built-in list")
+    parser.add_argument('--minlength', type=int, help="Only include passwords at least this long in the statistics")
+    parser.add_argument('--maxlength', type=int, help="Only include passwords at most this long in the statistics")
+    parser.add_argument('--charset', nargs='+', choices=CHARSETS,
+                        help="Only include passwords of these character-sets in the statistics")
+    parser.add_argument('--simplemask', nargs='+',
+                        help="Only include passwords of these simple masks in the statistics, e.g. stringdigit")
+    parser.add_argument('--features', type=str,
+                        help="Write the features of every account (length, character-set, masks, class counts, "
+                             "domain, policy results) to this file for fast filtered queries with featureindex.py")
+    parser.add_argument('--families', action='store_true', default=False,
+                        help="Cluster the cracked passwords into families of variants, e.g. Summer2023!, Summer2024! "
+                             "and Summ3r2024, and print the largest families")
+    parser.add_argument('--family-threshold', default=THRESHOLD, type=float,
+                        help="Least n-gram similarity of the base words of a password family, between 0 and 1. "
+                             "Default is \033[0;0;92m%s\033[0m" % THRESHOLD)
+    parser.add_argument('--hcmask', type=str,
+                        help="Write the advanced masks that crack the most passwords within --time-budget at "
+                             "--hashrate to this hashcat .hcmask file")
+    parser.add_argument('--hashrate', default=HASHRATE, type=parse_hashrate,
+                        help="Hashes per second of the cracking rig for --hcmask, e.g. 250G. Default is "
+                             "\033[0;0;92m%.0fG\033[0m" % (HASHRATE / 1e9))
+    parser.add_argument('--time-budget', default=TIME_BUDGET, type=parse_duration,
+                        help="Cracking time the --hcmask masks may take, e.g. 90m, 12h or 3d. Default is "
+                             "\033[0;0;92m%s\033[0m" % format_duration(TIME_BUDGET))
+    parser.add_argument('--profile', type=str,
+                        help="Time every stage (wall and CPU time, records/sec, peak RSS) and write them with cache "
+                             "hit rates and other counters to this JSON file")
+    parser.add_argument('--profile-sample', default=100, type=int,
+                        help="With --profile, sample every Nth account for the most frequent masks (and passwords "
+                             "with -P); 0 disables sampling. Default is \033[0;0;92m100\033[0m")
+    parser.add_argument('--jobs', default=1, type=int,
+                        help="Number of worker processes used to generate the password statistics")
+    parser.add_argument('--cache-size', default=200000, type=int,
+                        help="Number of distinct passwords whose analysis is cached. Default is \033[0;0;92m200000\033[0m")
+    parser.add_argument('--sketch-memory', type=float,
+                        help="Cap the memory of the advanced mask statistics at about this many MiB by keeping only "
+                             "the most frequent masks, and count distinct masks and passwords approximately")
     parser.add_argument('-M', '--metrics', action='store_true', default=False,
-                        help='Print metrics of AD password health data.')
+                        help='Print metrics of AD password health data and password statistics.')
     parser.add_argument('--machine', default=False, action='store_true',
                         help="Include machine accounts in results")
     parser.add_argument('-P', '--print_passwords', default=False, action='store_true',
                         help="Print passwords as part of output")
-    # parser.add_argument('-O', '--output', help="Output directory", required=True)
+    parser.add_argument('-O', '--output', help="Output directory for the metrics CSV")
     parser.add_argument('--verbose', action='store_true', default=False, help="Enable verbose Output")
     parser.add_argument('--debug', action='store_true', default=False, help="Enable debug output")
+    parser.add_argument('--snapshot', type=str,
+                        help="Snapshot file holding the statistics and per-account results of earlier runs. Only lines "
+                             "added to the input since the snapshot was taken are analysed, then the snapshot is updated")
+    parser.add_argument('--since', type=str,
+                        help="Report changes in breach counts and charset and mask distributions since this snapshot")
     parser.add_argument('--csv', default="pass_health.csv.learn_to_give_names_to_files", type=str, help="output to csv")
+    parser.add_argument('--jsonl', type=str, help="Also write the policy breaches to this file as JSON Lines")
+    parser.add_argument('--console', default="full", choices=sorted(CONSOLE),
+                        help="Print every policy breach, only a summary of them, or nothing. Default is "
+                             "\033[0;0;92mfull\033[0m")
 
     args = parser.parse_args()
+    profiler = Profiler() if args.profile else NULL_PROFILER
+    try:
+        inputs = expand_inputs(args.john)
+        potfiles = expand_inputs(args.pot)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        with profiler.stage("compile_policies"):
+            policies = PolicySet(resolve_policies(args.policy or ["legacy-ad"], args.number))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        parser.error("invalid --policy: %s" % e)
+    features = None
+    if args.features:
+        try:
+            features = FeatureWriter(policies.policies)
+        except ValueError as e:
+            parser.error("invalid --features: %s" % e)
+    wordlist = None
+    if args.wordlist:
+        try:
+            with profiler.stage("open_wordlist"):
+                wordlist = WordlistIndex(args.wordlist)
+        except (OSError, ValueError) as e:
+            parser.error("invalid --wordlist: %s" % e)
+    strength = None
+    if args.strength or args.strength_words:
+        with profiler.stage("load_estimator"):
+            strength = load_estimator(args.strength_words)
+    # One plain input is streamed and can be resumed; several are merged in memory first
+    merged = len(inputs) > 1 or potfiles
 
     DEBUG = args.debug
     VERBOSE = args.verbose
-    accounts = generate_accounts_dict(args.john)
-    breach_list = evaluate_password_health(accounts,print_password=args.print_passwords)
-    stats = StatsGen()
+    snapshot = None
+    since = None
+    start, stop = 0, None
+    with profiler.stage("load_snapshot"):
+        if args.since:
+            try:
+                since = Snapshot.load(args.since)
+            except (OSError, ValueError, EOFError, KeyError) as e:
+                parser.error("invalid --since: %s" % e)
+        if args.snapshot or since:
+            if args.snapshot and os.path.exists(args.snapshot):
+                try:
+                    snapshot = Snapshot.load(args.snapshot)
+                except (OSError, ValueError, EOFError, KeyError) as e:
+                    parser.error("invalid --snapshot: %s" % e)
+            else:
+                snapshot = Snapshot()
+                if since:
+                    snapshot.salt = since.salt
+            if merged:
+                snapshot.clear()
+                snapshot.source = None
+            else:
+                start, stop = snapshot.resume(inputs[0])
+                if start and (args.features or args.families):
+                    # The feature index and the families cover every account: analyse the whole input again
+                    if args.verbose:
+                        print("Analysing all of %s again for --features/--families" % inputs[0])
+                    snapshot.clear()
+                    start, stop = snapshot.resume(inputs[0])
+            stats = snapshot.stats
+        else:
+            stats = StatsGen()
+    stats.minlength = args.minlength
+    stats.maxlength = args.maxlength
+    stats.charsets = args.charset
+    stats.simplemasks = args.simplemask
+    # A snapshot saved in sketch mode comes back with its sketches
+    if args.sketch_memory and stats.sketch_capacity is None:
+        stats.enable_sketches(capacity_for_memory(args.sketch_memory))
+    store = None
+    if args.metrics:
+        store = AccountStore()
+    if merged:
+        with profiler.stage("merge_inputs"):
+            merger = merge_inputs(inputs, args.conflict, potfiles)
+        if args.verbose:
+            print("Merged %d accounts from %d inputs: %d duplicates, %d replaced, %d cracked from potfiles" %
+                  (len(merger), merger.inputs, merger.duplicates, merger.replaced, merger.potfile_cracked))
+        if store is not None:
+            accounts = store.extend(merger.records(), machine=args.machine)
+        else:
+            accounts = iter_cracked(merger.records(), machine=args.machine)
+    elif store is not None:
+        if start:
+            # The metrics cover the whole input: store the part analysed by earlier runs without analysing it again
+            for record in store.ingest(inputs[0], use_mmap=args.mmap, stop=start, machine=args.machine):
+                pass
+            if args.verbose:
+                print("Loaded %d accounts analysed by earlier runs for the metrics" % len(store))
+        accounts = store.ingest(inputs[0], use_mmap=args.mmap, start=start, stop=stop, machine=args.machine)
+    else:
+        seen = set()
+        if start:
+            # Accounts of the part analysed by earlier runs keep their first line, as in a full run
+            for record in unique_records(iter_john_lines(inputs[0], args.mmap, stop=start), seen):
+                pass
+        accounts = iter_john_records(inputs[0], use_mmap=args.mmap, start=start, stop=stop, machine=args.machine,
+                                     seen=seen)
+    cache = AnalysisCache(args.cache_size)
+    stats.cache = cache
+    stats.wordlist = wordlist
+    stats.strength = strength
     # for acc, password in accounts.items():
     #     stats.analyze_password(password=password)
-    if args.metrics:
-        stats.generate_stats(accounts)
-        stats.print_stats()
-
-
+    fused_stats = None
+    if (args.metrics or snapshot or args.hcmask) and args.jobs > 1:
+        accounts = stats.iter_parallel(accounts, args.jobs)
+    elif args.metrics or snapshot or args.hcmask:
+        fused_stats = stats
+    samplers = []
+    if profiler.enabled and args.profile_sample:
+        samplers.append(profiler.sampler("masks", args.profile_sample,
+                                         key=lambda record: analyze_codes(classify(record[1]))[3]))
+        if args.print_passwords:
+            samplers.append(profiler.sampler("passwords", args.profile_sample, key=lambda record: record[1]))
+    families = None
+    if args.families:
+        families = PasswordFamilies(args.family_threshold)
+        accounts = families.extend(accounts)
+    accounts = profiler.iterate("ingest", accounts, samplers)
+    reporters = [CONSOLE[args.console]()]
     if args.csv is not None:
-        fieldnames = ['username','password','Length','Capital','Lower','Digits','Symbols']
-        with open(args.csv,'w') as csvfile:
-            writer = csv.DictWriter(csvfile,fieldnames=fieldnames)
-            writer.writeheader()
-            for row in breach_list:
-                writer.writerow(row)
+        reporters.append(CsvReporter(args.csv, fieldnames=FIELDNAMES + ["Strength"] if strength else FIELDNAMES))
+    if args.jsonl:
+        reporters.append(JsonLinesReporter(args.jsonl))
+    reporter = MultiReporter(reporters)
+    profiler.instrument(cache, "lookup", "classify")
+    profiler.instrument(stats, "add_analysis", "statistics")
+    profiler.instrument(reporter, "breach", "report")
+    profiler.instrument(reporter, "close", "report")
+    if snapshot is not None:
+        profiler.instrument(snapshot, "record", "snapshot_record")
+    if strength is not None:
+        profiler.instrument(strength, "score", "strength")
+    if features is not None:
+        profiler.instrument(features, "add", "features")
+    with profiler.stage("evaluate_password_health") as stage:
+        with reporter:
+            breaches = evaluate_password_health(accounts,print_password=args.print_passwords, cache=cache,
+                                                stats=fused_stats, snapshot=snapshot, reporter=reporter,
+                                                policies=policies, wordlist=wordlist, strength=strength,
+                                                features=features)
+        # accounts may be a stream, so the accounts checked are only known now
+        if stage is not None:
+            stage.records += policies.counts()[0]
+    if args.policy or args.metrics:
+        policies.print_results()
+    if args.metrics:
+        with profiler.stage("generate_metrics", len(store)):
+            lm_index, ntlm_index = generate_metrics(store, weak=lambda password: is_weak(password, cache, policies, wordlist),
+                                                    output=args.output, verbose=args.verbose)
+        with profiler.stage("print_reuse"):
+            if len(lm_index):
+                print_reuse(store, lm_index, verbose=args.verbose, print_password=args.print_passwords)
+            print_reuse(store, ntlm_index, verbose=args.verbose, print_password=args.print_passwords)
+        with profiler.stage("print_stats", len(stats.stats_advancedmasks)):
+            if args.output:
+                stats.output_file = open(os.path.join(args.output, "ADPassHealth-Masks.csv"), 'w')
+            stats.print_stats()
+            if stats.output_file:
+                stats.output_file.close()
+                stats.output_file = None
+        cache.print_stats()
+    if families is not None:
+        with profiler.stage("print_families", len(families.accounts)):
+            print_families(families, verbose=args.verbose, print_password=args.print_passwords)
+    if args.hcmask:
+        with profiler.stage("select_masks", len(stats.stats_advancedmasks)):
+            selected = select_masks(stats.stats_advancedmasks.items(), args.hashrate, args.time_budget)
+            write_hcmask(args.hcmask, selected)
+        print_selection(selected, stats.filter_counter, len(stats.stats_advancedmasks), args.hashrate,
+                        args.time_budget, verbose=args.verbose)
+    if since:
+        with profiler.stage("print_delta"):
+            snapshot.print_delta(since)
+    if features is not None:
+        with profiler.stage("save_features", len(features.rows)):
+            features.save(args.features)
+    if args.snapshot:
+        with profiler.stage("save_snapshot", len(snapshot.accounts)):
+            snapshot.advance(inputs[0], stop)
+            snapshot.save(args.snapshot)
+
+    if profiler.enabled:
+        checked, failures = policies.counts()
+        profiler.count("accounts", checked)
+        profiler.count("breaches", breaches)
+        profiler.count("policy_failures", dict(zip([policy.name for policy in policies.policies], failures)))
+        profiler.count("cache_hits", cache.hits)
+        profiler.count("cache_misses", cache.misses)
+        profiler.count("cache_hit_rate", cache.hit_rate())
+        profiler.count("cache_evictions", cache.evictions)
+        if store is not None:
+            profiler.count("store_bytes", store.nbytes())
+        if strength is not None:
+            profiler.count("strength_cached", strength.cached)
+        profiler.finish(args.profile)
+        print("\n[*] Profile written to %s" % args.profile)
 
     # pprint(accounts)
     # if args.aduserinfo:
     #     accounts = get_ad_user_info(accounts, args.aduserinfo)
     # write_password_health_csv(accounts, args.output)
-    # if args.metrics:
-    #     generate_metrics(accounts)
     # print "File saved to %s" % args.output
 # TODO output metrics for the creation of pie charts
-# TODO compare over time metrics
 # TODO determine if account meets complexity requirements
@@ -0,0 +1,193 @@
+import glob
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from potfile import account_key, iter_chunks, parse_john_line, split_lines
+
+# Which record is kept when several inputs have the same DOMAIN\user
+CONFLICT_RULES = ("first", "last", "cracked")
+
+# Upper bound on the reader threads
+MAX_WORKERS = 8
+
+# Chunks of potfile.READ_CHUNK bytes read ahead of the parser per input
+READ_AHEAD = 4
+
+
+def expand_inputs(patterns):
+    """Return the input files named by patterns, which may be paths, '-' for stdin, glob patterns or
+    directories (read recursively, skipping hidden files). Files named twice are read once. Raises
+    ValueError for a path that is not a readable file."""
+    paths = []
+    for pattern in patterns:
+        if pattern == "-":
+            matches = [pattern]
+        elif os.path.isdir(pattern):
+            matches = []
+            for root, dirs, files in os.walk(pattern):
+                dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+                matches.extend(os.path.join(root, name) for name in sorted(files) if not name.startswith("."))
+        elif glob.has_magic(pattern):
+            matches = sorted(path for path in glob.glob(pattern) if os.path.isfile(path))
+            if not matches:
+                raise ValueError("no input file matches %s" % pattern)
+        else:
+            if not os.path.isfile(pattern):
+                raise ValueError("no such input file: %s" % pattern)
+            if not os.access(pattern, os.R_OK):
+                raise ValueError("cannot read input file: %s" % pattern)
+            matches = [pattern]
+        for path in matches:
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def parse_accounts(chunks):
+    """Yield the JohnRecords of the chunks of a john --show or pwdump file"""
+    for line in split_lines(chunks):
+        record = parse_john_line(line)
+        if record is not None:
+            yield record
+
+
+def _unhex(password):
+    """Decode the $HEX[...] form hashcat uses for passwords with unusual characters"""
+    if password.startswith("$HEX[") and password.endswith("]"):
+        try:
+            return bytes.fromhex(password[5:-1]).decode("utf-8", "replace")
+        except ValueError:
+            pass
+    return password
+
+
+def parse_potfile(chunks):
+    """Return {NTLM digest: password} from the chunks of a hashcat potfile of hash:password lines.
+    Lines of other hash types are ignored."""
+    cracked = {}
+    for line in split_lines(chunks):
+        digest, sep, password = line.partition(":")
+        if not sep or len(digest) != 32:
+            continue
+        try:
+            cracked[bytes.fromhex(digest)] = _unhex(password)
+        except ValueError:
+            continue
+    return cracked
+
+
+class AccountMerger:
+    """Merges the records of several inputs into one record per DOMAIN\\user.
+
+    Accounts are matched case-insensitively, as Windows does, and keep the position of their first
+    occurrence. conflict decides which record is kept: the first seen, the last seen, or the first
+    cracked one. Records must be added in input order for the result to be deterministic.
+    """
+
+    def __init__(self, conflict="first"):
+        if conflict not in CONFLICT_RULES:
+            raise ValueError("unknown conflict rule %r" % conflict)
+        self.conflict = conflict
+        self.accounts = {}
+        self.inputs = 0
+        self.duplicates = 0
+        self.replaced = 0
+        self.potfile_cracked = 0
+
+    def add(self, records):
+        """Merge the records of one input"""
+        self.inputs += 1
+        accounts = self.accounts
+        for record in records:
+            key = account_key(record)
+            old = accounts.get(key)
+            if old is None:
+                accounts[key] = record
+                continue
+            self.duplicates += 1
+            if self.conflict == "last" or \
+                    (self.conflict == "cracked" and old.password is None and record.password is not None):
+                accounts[key] = record
+                self.replaced += 1
+
+    def crack(self, cracked):
+        """Fill in the password of uncracked accounts whose NTLM hash is in cracked, {digest: password}"""
+        accounts = self.accounts
+        for key, record in accounts.items():
+            if record.password is None and record.ntlm in cracked:
+                accounts[key] = record._replace(password=cracked[record.ntlm])
+                self.potfile_cracked += 1
+
+    def records(self):
+        return self.accounts.values()
+
+    def __len__(self):
+        return len(self.accounts)
+
+
+def _read_ahead(path, chunks, stopped):
+    """Put the chunks of path on the queue chunks followed by None, or the exception raised reading
+    it. Gives up once stopped is set, so a reader blocked on a full queue never outlives the merge."""
+    def put(item):
+        while not stopped.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        for chunk in iter_chunks(path):
+            if not put(chunk):
+                return
+    except Exception as e:
+        put(e)
+        return
+    put(None)
+
+
+def _drain(chunks):
+    """Yield the chunks put on a queue by _read_ahead"""
+    while True:
+        chunk = chunks.get()
+        if chunk is None:
+            return
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
+
+
+def merge_inputs(paths, conflict="first", potfiles=(), workers=None):
+    """Read john --show/pwdump files and hashcat potfiles concurrently and return an AccountMerger
+    holding one record per account.
+
+    A thread pool reads and decompresses the files; that work releases the GIL, so it overlaps
+    with parsing. Every reader streams its file in chunks through a queue holding at most
+    READ_AHEAD chunks, so memory stays bounded whatever the size of the inputs. Parsing holds the
+    GIL and is done here, file by file in the order the paths were given while later files are
+    read ahead, so the result does not depend on which file finishes first.
+    """
+    merger = AccountMerger(conflict)
+    if workers is None:
+        workers = min(len(paths) + len(potfiles), MAX_WORKERS) or 1
+    stopped = threading.Event()
+    # Readers start in the order their queues are drained, so a pool smaller than the number of
+    # inputs never waits on a reader that has not started
+    queues = [queue.Queue(READ_AHEAD) for _ in range(len(paths) + len(potfiles))]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for path, chunks in zip(list(paths) + list(potfiles), queues):
+            executor.submit(_read_ahead, path, chunks, stopped)
+        try:
+            for chunks in queues[:len(paths)]:
+                merger.add(parse_accounts(_drain(chunks)))
+            cracked = {}
+            for chunks in queues[len(paths):]:
+                cracked.update(parse_potfile(_drain(chunks)))
+        finally:
+            stopped.set()
+    if cracked:
+        merger.crack(cracked)
+    return merger
@@ -0,0 +1,177 @@
+import argparse
+import csv
+import sys
+import time
+
+from snapshot import Snapshot
+
+# Candidates per position of the hashcat built-in charsets
+CHARSET_SIZES = {"?l": 26, "?u": 26, "?d": 10, "?s": 33, "?a": 95, "?h": 16, "?H": 16, "?b": 256}
+
+# Hashes per second of the default rig, roughly NTLM on one current GPU
+HASHRATE = 100e9
+
+# Default time budget of a mask set in seconds
+TIME_BUDGET = 24 * 3600
+
+_UNITS = {"": 1, "k": 1e3, "m": 1e6, "g": 1e9, "t": 1e12}
+_DURATIONS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def parse_hashrate(text):
+    """Parse a hash rate such as 250G, 1.5m or 40000 into hashes per second"""
+    text = text.strip().lower().rstrip("h/s")
+    rate = float(text[:-1]) * _UNITS[text[-1]] if text[-1:] in _UNITS else float(text)
+    if rate <= 0:
+        raise ValueError("hash rate must be positive")
+    return rate
+
+
+def parse_duration(text):
+    """Parse a duration such as 90m, 12h, 3d or 3600 into seconds"""
+    text = text.strip().lower()
+    seconds = float(text[:-1]) * _DURATIONS[text[-1]] if text[-1:] in _DURATIONS else float(text)
+    if seconds <= 0:
+        raise ValueError("duration must be positive")
+    return seconds
+
+
+def format_duration(seconds):
+    """Format seconds as the two largest units, e.g. 3d 4h or 12m 5s"""
+    if seconds < 1:
+        return "<1s"
+    parts = []
+    for unit, size in (("y", 31536000), ("d", 86400), ("h", 3600), ("m", 60), ("s", 1)):
+        if seconds >= size or parts:
+            parts.append("%d%s" % (seconds // size, unit))
+            seconds %= size
+        if len(parts) == 2:
+            break
+    return " ".join(parts)
+
+
+def _keyspace_slow(mask):
+    size = 1
+    position = 0
+    while position < len(mask):
+        token = mask[position:position + 2]
+        if token == "??":
+            position += 2
+        elif token in CHARSET_SIZES:
+            size *= CHARSET_SIZES[token]
+            position += 2
+        elif token[0] == "?":
+            raise ValueError("mask %s uses an unsupported charset %s" % (mask, token))
+        else:
+            position += 1
+    return size
+
+
+def keyspace(mask):
+    """Return the number of candidates of a hashcat mask. Literal characters count once."""
+    # Masks built by StatsGen are only ?d, ?l, ?u and ?s tokens, anything else is parsed token by token
+    digits = mask.count("?d")
+    letters = mask.count("?l") + mask.count("?u")
+    specials = mask.count("?s")
+    if 2 * (digits + letters + specials) != len(mask) or "??" in mask:
+        return _keyspace_slow(mask)
+    return 10 ** digits * 26 ** letters * 33 ** specials
+
+
+def cost_masks(masks, hashrate=HASHRATE):
+    """Return (mask, count, keyspace, seconds) for every (mask, count), most efficient first.
+
+    Efficiency is the passwords a mask cracked per candidate it tries, i.e. coverage per second of
+    GPU time at any hash rate. Ties go to the more frequent mask.
+    """
+    costed = [(count / size, count, mask, size) for mask, count, size in
+              ((mask, count, keyspace(mask)) for mask, count in masks if count > 0)]
+    costed.sort(reverse=True)
+    return [(mask, count, size, size / hashrate) for _, count, mask, size in costed]
+
+
+def select_masks(masks, hashrate=HASHRATE, budget=TIME_BUDGET):
+    """Pick the masks that cover the most passwords within budget seconds at hashrate.
+
+    Masks are taken greedily in order of efficiency; one that does not fit in what is left of the
+    budget is skipped and the next, usually smaller, ones are still tried. Returns the chosen
+    (mask, count, keyspace, seconds) in the order they should run.
+    """
+    selected = []
+    left = budget
+    for entry in cost_masks(masks, hashrate):
+        if entry[3] <= left:
+            selected.append(entry)
+            left -= entry[3]
+    return selected
+
+
+def write_hcmask(path, selected):
+    """Write the masks as a hashcat .hcmask file, one mask per line"""
+    with open(path, "w") as f:
+        for entry in selected:
+            f.write(entry[0] + "\n")
+
+
+def read_masks(path):
+    """Read mask,count lines as written by StatsGen.output_file, '-' reads stdin"""
+    f = sys.stdin if path == "-" else open(path, newline="")
+    try:
+        masks = {}
+        for row in csv.reader(f):
+            if len(row) < 2 or not row[0] or row[0].startswith("#"):
+                continue
+            masks[row[0]] = masks.get(row[0], 0) + int(row[1])
+        return masks
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def print_selection(selected, total, distinct, hashrate, budget, verbose=False, limit=20):
+    """Print coverage and cost of a mask set. total is the number of passwords the masks were counted
+    over and distinct the number of masks the set was picked from."""
+    covered = sum(entry[1] for entry in selected)
+    seconds = sum(entry[3] for entry in selected)
+    print("\n[*] Mask set:")
+    print("[+] %25s: %d of %d" % ("masks", len(selected), distinct))
+    print("[+] %25s: %02d%% (%d)" % ("coverage", covered * 100 // total if total else 0, covered))
+    print("[+] %25s: %s of %s at %.3g H/s" % ("estimated time", format_duration(seconds), format_duration(budget),
+                                              hashrate))
+    if not verbose:
+        return
+    cumulative = 0
+    elapsed = 0.0
+    for mask, count, size, cost in selected[:limit]:
+        cumulative += count
+        elapsed += cost
+        print("[+] %25s: %02d%% (%d) %s, total %02d%% after %s" % (
+            mask, count * 100 // total if total else 0, count, format_duration(cost),
+            cumulative * 100 // total if total else 0, format_duration(elapsed)))
+
+
+if __name__ == '__main__':
+    """Pick a time-bounded hashcat mask set from advanced mask counts"""
+    parser = argparse.ArgumentParser()
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-m', '--masks', help="mask,count file, use - to read from stdin")
+    source.add_argument('--snapshot', help="Use the advanced masks of a health.py --snapshot file")
+    parser.add_argument('-o', '--output', required=True, help="hashcat .hcmask file to write")
+    parser.add_argument('--hashrate', default=HASHRATE, type=parse_hashrate,
+                        help="Hashes per second of the rig, e.g. 250G. Default is \033[0;0;92m%.0fG\033[0m" %
+                             (HASHRATE / 1e9))
+    parser.add_argument('--time-budget', default=TIME_BUDGET, type=parse_duration,
+                        help="Cracking time the masks may take, e.g. 90m, 12h or 3d. Default is "
+                             "\033[0;0;92m%s\033[0m" % format_duration(TIME_BUDGET))
+    parser.add_argument('--verbose', action='store_true', default=False, help="List the chosen masks")
+
+    args = parser.parse_args()
+    started = time.time()
+    if args.snapshot:
+        masks = Snapshot.load(args.snapshot).stats.stats_advancedmasks
+    else:
+        masks = read_masks(args.masks)
+    selected = select_masks(masks.items(), args.hashrate, args.time_budget)
+    write_hcmask(args.output, selected)
+    print_selection(selected, sum(masks.values()), len(masks), args.hashrate, args.time_budget, verbose=args.verbose)
+    print("[*] Wrote %d masks to %s in %.1fs" % (len(selected), args.output, time.time() - started))
@@ -0,0 +1,189 @@
+import json
+
+# Character classes in the order of analysiscache.complexity_flags
+CLASSES = ("upper", "lower", "digits", "symbols")
+
+# Broken rule label of each missing class, as printed by evaluate_password_health
+CLASS_LABELS = ("no upper case", "no lower case", "no numbers", "non symbols")
+
+# Broken rule labels of a password shorter than a minimum or longer than a maximum length
+TOO_SHORT = "too short"
+TOO_LONG = "too long"
+
+_RULES = ("min_length", "max_length", "min_classes", "require", "blocklist")
+
+
+class Policy:
+    """One password policy: length bounds, a minimum number of character classes, classes that are
+    always required and whether passwords found in the wordlist index are rejected. Classes are
+    upper, lower, digits and symbols."""
+
+    def __init__(self, name, min_length=0, max_length=None, min_classes=0, require=(), blocklist=False):
+        for cls in require:
+            if cls not in CLASSES:
+                raise ValueError("policy %s requires unknown character class %r" % (name, cls))
+        if not 0 <= min_classes <= len(CLASSES):
+            raise ValueError("policy %s needs between 0 and %d classes" % (name, len(CLASSES)))
+        self.name = name
+        self.min_length = min_length
+        self.max_length = max_length
+        self.min_classes = min_classes
+        self.require = tuple(require)
+        self.blocklist = blocklist
+
+    @classmethod
+    def from_dict(cls, definition):
+        unknown = set(definition) - set(_RULES) - {"name"}
+        if unknown:
+            raise ValueError("unknown policy rules %s" % ", ".join(sorted(unknown)))
+        return cls(**definition)
+
+    def to_dict(self):
+        return {"name": self.name, "min_length": self.min_length, "max_length": self.max_length,
+                "min_classes": self.min_classes, "require": list(self.require), "blocklist": self.blocklist}
+
+    def length_ok(self, length):
+        return length >= self.min_length and (self.max_length is None or length <= self.max_length)
+
+    def classes_ok(self, flags):
+        if sum(flags) < self.min_classes:
+            return False
+        return all(flags[CLASSES.index(cls)] for cls in self.require)
+
+
+def builtin_policies(min_length=8):
+    """Return the built-in policies by name. min_length is the -N length of legacy-ad."""
+    return {
+        # Windows "complexity requirements": 3 of the 4 classes
+        "legacy-ad": Policy("legacy-ad", min_length=min_length, min_classes=3),
+        "ad-14": Policy("ad-14", min_length=14, min_classes=3),
+        # Length and no commonly used or breached passwords, no composition rules
+        "nist-800-63b": Policy("nist-800-63b", min_length=8, max_length=64, blocklist=True),
+    }
+
+
+def load_policies(path):
+    """Read policies from a JSON file holding a list of policy objects, or {"policies": [...]}"""
+    with open(path) as f:
+        definitions = json.load(f)
+    if isinstance(definitions, dict):
+        definitions = definitions["policies"]
+    return [Policy.from_dict(definition) for definition in definitions]
+
+
+def resolve_policies(names, min_length=8):
+    """Return the policies for a list of built-in policy names and JSON policy files"""
+    builtins = builtin_policies(min_length)
+    policies = []
+    for name in names:
+        if name in builtins:
+            policies.append(builtins[name])
+        else:
+            policies.extend(load_policies(name))
+    return policies
+
+
+class PolicySet:
+    """Several policies compiled into one lookup table.
+
+    Every policy only depends on the complexity flags and the length of a password, so the pass
+    bits of all policies (bit i for policy i) are precomputed for each of the 16 flag combinations
+    and each length up to the largest threshold. Checking a password against any number of
+    policies is then one dict and one list lookup, plus clearing the bits of blocklist policies
+    for a password found in the wordlist. Results are counted per combination of pass bits.
+    """
+
+    def __init__(self, policies):
+        if not policies:
+            raise ValueError("no password policy given")
+        if len(set(policy.name for policy in policies)) != len(policies):
+            raise ValueError("policy names must be unique")
+        self.policies = list(policies)
+        self.all = (1 << len(self.policies)) - 1
+        self.outcomes = {}  # pass bits -> passwords with that result
+        self._names = {}
+
+        thresholds = [policy.min_length for policy in self.policies] + \
+                     [policy.max_length + 1 for policy in self.policies if policy.max_length is not None]
+        self.cap = max(thresholds)
+        lengths = [sum(1 << i for i, policy in enumerate(self.policies) if policy.length_ok(length))
+                   for length in range(self.cap + 1)]
+        self.length_bits = lengths
+        self.blocklist_bits = sum(1 << i for i, policy in enumerate(self.policies) if policy.blocklist)
+        self.class_bits = {}
+        self.table = {}
+        for combination in range(1 << len(CLASSES)):
+            flags = tuple(bool(combination & (1 << c)) for c in range(len(CLASSES)))
+            classes = sum(1 << i for i, policy in enumerate(self.policies) if policy.classes_ok(flags))
+            self.class_bits[flags] = classes
+            self.table[flags] = [classes & bits for bits in lengths]
+
+    def __len__(self):
+        return len(self.policies)
+
+    def names(self, bits):
+        """Return the names of the policies whose bit is set"""
+        names = self._names.get(bits)
+        if names is None:
+            names = self._names[bits] = tuple(policy.name for i, policy in enumerate(self.policies) if bits & (1 << i))
+        return names
+
+    def evaluate(self, length, flags, listed=False):
+        """Return the pass bits of a password of length with the given complexity flags, listed if it is in
+        the wordlist, and count the result"""
+        bits = self.table[flags][length if length < self.cap else self.cap]
+        if listed:
+            bits &= ~self.blocklist_bits
+        self.outcomes[bits] = self.outcomes.get(bits, 0) + 1
+        return bits
+
+    def counts(self):
+        """Return (passwords checked, [failures of each policy])"""
+        failures = [0] * len(self.policies)
+        for bits, count in self.outcomes.items():
+            for i in range(len(self.policies)):
+                if not bits & (1 << i):
+                    failures[i] += count
+        return sum(self.outcomes.values()), failures
+
+    def length_rule(self, length, bits):
+        """Return "too short" or "too long" if a policy failed in bits has a length rule that length
+        breaks, else None"""
+        if not self.all & ~bits & ~self.length_bits[length if length < self.cap else self.cap]:
+            return None
+        for i, policy in enumerate(self.policies):
+            if not bits & (1 << i) and length < policy.min_length:
+                return TOO_SHORT
+        return TOO_LONG
+
+    def classes_failed(self, flags, bits):
+        """Return True if a policy failed in bits has a character class rule that flags break"""
+        return bool(self.all & ~bits & ~self.class_bits[flags])
+
+    def broken_rules(self, length, flags, bits, listed=False):
+        """Return the broken rule labels of a password failing the policies in bits, as reported by
+        evaluate_password_health: the length rule if one is broken, the missing classes and
+        "in wordlist\""""
+        length_rule = self.length_rule(length, bits)
+        broken = [length_rule] if length_rule else []
+        if self.classes_failed(flags, bits):
+            broken.extend(label for present, label in zip(flags, CLASS_LABELS) if not present)
+        if listed and self.blocklist_bits & ~bits:
+            broken.append("in wordlist")
+        return broken
+
+    def passes(self, password, cache, wordlist=None):
+        """Return True if password passes every policy; does not count"""
+        bits = self.table[cache.policy(password)][min(len(password), self.cap)]
+        if self.blocklist_bits and wordlist is not None and password in wordlist:
+            bits &= ~self.blocklist_bits
+        return bits == self.all
+
+    def print_results(self):
+        """Print pass and fail counts per policy"""
+        checked, failures = self.counts()
+        print("\n[*] Password policies:")
+        for policy, failed in zip(self.policies, failures):
+            passed = checked - failed
+            share = passed * 100 // checked if checked else 0
+            print("[+] %25s: %02d%% pass (%d pass, %d fail)" % (policy.name, share, passed, failed))
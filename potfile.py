@@ -0,0 +1,268 @@
+import bz2
+import gzip
+import io
+import lzma
+import mmap
+import os
+import re
+import sys
+from collections import namedtuple
+
+ENCODING = "utf-8"
+
+# Bytes read per step on the mmap fast path
+MMAP_CHUNK = 16 * 1024 * 1024
+
+# Bytes per chunk of iter_chunks
+READ_CHUNK = 1024 * 1024
+
+# Leading bytes of the compressed formats we can read directly
+_COMPRESSED = ((b"\x1f\x8b", gzip.open),
+               (b"BZh", bz2.open),
+               (b"\xfd7zXZ\x00", lzma.open))
+
+
+def _decompressor(head):
+    """Return the opener matching the magic bytes in head, or None for plain text"""
+    for magic, opener in _COMPRESSED:
+        if head.startswith(magic):
+            return opener
+    return None
+
+
+def _iter_text(binary):
+    """Yield decoded lines from a binary stream"""
+    for line in io.TextIOWrapper(binary, encoding=ENCODING, errors="replace"):
+        yield line.rstrip("\r\n")
+
+
+def _iter_mmap(fileobj, start=0, stop=None):
+    """Yield decoded lines between byte offsets start and stop of a plain file by decoding large mmap'd chunks"""
+    if os.fstat(fileobj.fileno()).st_size == 0:
+        return
+    with mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm) if stop is None else min(stop, len(mm))
+        pos = start
+        while pos < size:
+            end = size if pos + MMAP_CHUNK >= size else mm.find(b"\n", pos + MMAP_CHUNK, size)
+            if end == -1:
+                end = size
+            chunk = mm[pos:end]
+            if chunk.endswith(b"\n"):
+                chunk = chunk[:-1]
+            for line in chunk.decode(ENCODING, "replace").split("\n"):
+                yield line.rstrip("\r")
+            pos = end + 1
+
+
+def complete_length(path):
+    """Return the byte offset just past the last line of a plain file, or None if the file is
+    compressed and cannot be read from an offset. A final line without a line break counts as
+    complete, as john and pwdump output often ends that way."""
+    with open(path, "rb") as raw:
+        if _decompressor(raw.read(6)) is not None:
+            return None
+        return os.fstat(raw.fileno()).st_size
+
+
+def iter_lines(source, use_mmap=False, start=0, stop=None):
+    """Yield the lines of source without line endings.
+
+    source is a path, '-' for stdin, or an already open file object. gzip, bz2 and xz
+    input is detected from its magic bytes and decompressed on the fly. use_mmap enables
+    the mmap fast path for plain, uncompressed files. start and stop limit reading to a
+    byte range of a plain file, e.g. to resume after the lines already processed.
+    """
+    if hasattr(source, "read"):
+        for line in source:
+            if isinstance(line, bytes):
+                line = line.decode(ENCODING, "replace")
+            yield line.rstrip("\r\n")
+        return
+
+    if source == "-":
+        binary = sys.stdin.buffer
+        opener = _decompressor(binary.peek(6)[:6])
+        if opener is not None:
+            binary = opener(binary)
+        for line in _iter_text(binary):
+            yield line
+        return
+
+    with open(source, "rb") as raw:
+        opener = _decompressor(raw.read(6))
+        raw.seek(0)
+        if opener is not None and (start or stop is not None):
+            raise ValueError("%s is compressed and cannot be read from an offset" % source)
+        if start or stop is not None:
+            for line in _iter_mmap(raw, start, stop):
+                yield line
+        elif opener is not None:
+            with opener(raw) as binary:
+                for line in _iter_text(binary):
+                    yield line
+        elif use_mmap:
+            for line in _iter_mmap(raw):
+                yield line
+        else:
+            for line in _iter_text(raw):
+                yield line
+
+
+def _chunks(binary, size):
+    """Yield the content of a binary stream in chunks of about size bytes ending at a line break"""
+    rest = b""
+    while True:
+        data = binary.read(size)
+        if not data:
+            break
+        end = data.rfind(b"\n") + 1
+        if not end:
+            rest += data
+            continue
+        yield rest + data[:end]
+        rest = data[end:]
+    if rest:
+        yield rest
+
+
+def iter_chunks(source, size=READ_CHUNK):
+    """Yield the decompressed content of a path or '-' for stdin in chunks of whole lines.
+
+    File reads and decompression release the GIL, so threads reading several inputs this way
+    overlap their I/O and decompression while parsing stays in one thread.
+    """
+    if source == "-":
+        binary = sys.stdin.buffer
+        opener = _decompressor(binary.peek(6)[:6])
+        for chunk in _chunks(opener(binary) if opener is not None else binary, size):
+            yield chunk
+        return
+    with open(source, "rb") as raw:
+        opener = _decompressor(raw.read(6))
+        raw.seek(0)
+        if opener is None:
+            for chunk in _chunks(raw, size):
+                yield chunk
+            return
+        with opener(raw) as binary:
+            for chunk in _chunks(binary, size):
+                yield chunk
+
+
+def split_lines(chunks):
+    """Yield the decoded lines of chunks of bytes returned by iter_chunks"""
+    for data in chunks:
+        if data.endswith(b"\n"):
+            data = data[:-1]
+        for line in data.decode(ENCODING, "replace").split("\n"):
+            yield line.rstrip("\r")
+
+
+# One account line; password is None for uncracked pwdump lines, lm and ntlm are 16-byte
+# digests or None, enabled is True, False or None when the status is not given
+JohnRecord = namedtuple("JohnRecord", "domain username password rid lm ntlm last_set enabled")
+
+_PARENTHESIZED = re.compile(r"\(([^)]*)\)")
+
+
+def _digest(value):
+    """Return the 16-byte digest of a 32 character hex hash, or None"""
+    if len(value) != 32:
+        return None
+    try:
+        return bytes.fromhex(value)
+    except ValueError:
+        return None
+
+
+def parse_john_line(line):
+    """Parse one line of john --show or pwdump output into a JohnRecord, or None for other lines.
+
+    Accepted forms are
+        DOMAIN\\user:password:RID:LMHash:NTLMHash::: (pwdLastSet) (status)   cracked
+        DOMAIN\\user:RID:LMHash:NTLMHash::: (pwdLastSet) (status)            uncracked
+        user:password[:...]                                                 other hash formats
+    where the domain, pwdLastSet and status parts are optional.
+    """
+    head, sep, tail = line.rpartition(":::")
+    fields = head.rsplit(":", 3) if sep else ()
+    if len(fields) == 4 and fields[1].isdigit() and _digest(fields[3]) is not None:
+        account, rid, lm, ntlm = fields
+        account, cracked, password = account.partition(":")
+        if not cracked:
+            password = None
+        last_set = status = None
+        extras = _PARENTHESIZED.findall(tail)
+        if extras:
+            last_set = extras[0].split("=", 1)[-1] if extras[0].startswith("pwdLastSet") else extras[0]
+        if len(extras) > 1:
+            status = extras[1].split("=", 1)[-1].lower()
+        enabled = None if status is None else status == "enabled"
+        rid, lm, ntlm = int(rid), _digest(lm), _digest(ntlm)
+    else:
+        fields = line.split(":", 2)
+        if len(fields) < 2:
+            return None
+        account, password = fields[0], fields[1]
+        rid = lm = ntlm = last_set = enabled = None
+
+    domain, backslash, username = account.rpartition("\\")
+    return JohnRecord(domain or None, username, password, rid, lm, ntlm, last_set, enabled)
+
+
+def account_name(record):
+    """Return the DOMAIN\\user name of a JohnRecord as written in the input"""
+    return "%s\\%s" % (record.domain, record.username) if record.domain else record.username
+
+
+def iter_john_lines(source, use_mmap=False, start=0, stop=None):
+    """Yield a JohnRecord for every account line of source, see parse_john_line"""
+    for line in iter_lines(source, use_mmap, start, stop):
+        record = parse_john_line(line)
+        if record is not None:
+            yield record
+
+
+def account_key(record):
+    """Return the identity of the account of a JohnRecord: its domain and username, lower-cased as
+    Windows matches them"""
+    return (record.domain or "").lower(), record.username.lower()
+
+
+def unique_records(records, seen=None):
+    """Yield the JohnRecords of records, skipping any account that already occurred, e.g. a
+    re-cracked account appended to the file; the first line of an account wins. Accounts are
+    matched by account_key and kept as hashes in seen, a new set by default, so memory grows with
+    the distinct accounts only."""
+    if seen is None:
+        seen = set()
+    for record in records:
+        key = hash(account_key(record))
+        if key in seen:
+            continue
+        seen.add(key)
+        yield record
+
+
+def iter_cracked(records, machine=False):
+    """Yield (username, password) for the cracked accounts among JohnRecords. Uncracked pwdump lines
+    and, unless machine is set, machine accounts (ending in $) are skipped."""
+    for record in records:
+        if record.password is not None and (machine or not record.username.endswith("$")):
+            yield account_name(record), record.password
+
+
+def iter_john_records(source, use_mmap=False, start=0, stop=None, machine=False, unique=True, seen=None):
+    """Yield (username, password) for every cracked user account in john --show output.
+
+    Records are produced lazily, so the input is never held in memory. Lines are parsed with
+    parse_john_line, so uncracked pwdump lines are skipped like AccountStore.ingest does. A
+    username that occurs again is only yielded the first time, see unique_records, whose seen set
+    may already hold the accounts before start; with unique False every line is yielded. start
+    and stop are passed on to iter_lines.
+    """
+    records = iter_john_lines(source, use_mmap, start, stop)
+    if unique:
+        records = unique_records(records, seen)
+    return iter_cracked(records, machine)
@@ -0,0 +1,204 @@
+import json
+import platform
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+from sketches import SpaceSaving
+
+
+class _Stage:
+    __slots__ = ("seconds", "child_seconds", "cpu_seconds", "records", "max_rss_kib")
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.child_seconds = 0.0
+        self.cpu_seconds = None
+        self.records = 0
+        self.max_rss_kib = None
+
+    def to_dict(self):
+        return {"seconds": self.seconds,
+                "self_seconds": self.seconds - self.child_seconds,
+                "cpu_seconds": self.cpu_seconds,
+                "records": self.records,
+                "records_per_second": self.records / self.seconds if self.seconds and self.records else None,
+                "max_rss_kib": self.max_rss_kib}
+
+
+def _max_rss_kib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Profiler:
+    """Per-stage instrumentation of a run.
+
+    Stages are timed three ways: blocks with stage(), iterators with iterate() (time spent producing
+    items) and object methods with instrument() (time spent in every call). Stages nest, so each
+    reports its total and its self time without the stages running inside it; blocks also report
+    CPU time and the peak RSS so far. Counters hold anything else worth reporting, such as cache hit
+    rates, and sample() keeps the most frequent of every Nth key in a bounded summary.
+
+    Hooks registered with add_hook are called as hook(event, name, data): ("stage", name, stage dict)
+    after every stage() block and ("finish", None, document) from finish(), so embedding code can
+    collect the same numbers without the JSON file.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.started = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self.stages = {}
+        self.counters = {}
+        self.samples = {}
+        self.hooks = []
+        self._stack = []  # time spent in nested stages, per open stage
+
+    def _stage(self, name):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = _Stage()
+        return stage
+
+    def _account(self, stage, elapsed, records):
+        stage.seconds += elapsed
+        stage.child_seconds += self._stack.pop()
+        stage.records += records
+        if self._stack:
+            self._stack[-1] += elapsed
+
+    @contextmanager
+    def stage(self, name, records=0):
+        """Time the block as stage name, handling records records"""
+        stage = self._stage(name)
+        self._stack.append(0.0)
+        cpu = time.process_time()
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            self._account(stage, time.perf_counter() - start, records)
+            stage.cpu_seconds = (stage.cpu_seconds or 0.0) + time.process_time() - cpu
+            stage.max_rss_kib = _max_rss_kib()
+            for hook in self.hooks:
+                hook("stage", name, stage.to_dict())
+
+    def iterate(self, name, iterable, samplers=()):
+        """Yield the items of iterable, timing the production of each as stage name. Every item is also
+        passed to the samplers, outside of the timing."""
+        stage = self._stage(name)
+        iterator = iter(iterable)
+        clock = time.perf_counter
+        while True:
+            self._stack.append(0.0)
+            start = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self._account(stage, clock() - start, 0)
+                return
+            self._account(stage, clock() - start, 1)
+            for sample in samplers:
+                sample(item)
+            yield item
+
+    def instrument(self, obj, method, name=None):
+        """Time every call of obj.method as stage name (default the method name). Only the instance is
+        changed; each call counts as one record."""
+        stage = self._stage(name or method)
+        original = getattr(obj, method)
+        stack = self._stack
+        clock = time.perf_counter
+
+        def timed(*args, **kwargs):
+            stack.append(0.0)
+            start = clock()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                stage.seconds += elapsed
+                stage.child_seconds += stack.pop()
+                stage.records += 1
+                if stack:
+                    stack[-1] += elapsed
+
+        setattr(obj, method, timed)
+        return obj
+
+    def count(self, name, value):
+        """Set counter name"""
+        self.counters[name] = value
+
+    def sampler(self, name, every=100, capacity=20, key=None):
+        """Return a function adding every every-th item it is given, mapped through key, to sample name"""
+        summary = self.samples[name] = SpaceSaving(capacity)
+        seen = [0]
+
+        def sample(item):
+            seen[0] += 1
+            if seen[0] % every == 0:
+                summary.add(key(item) if key is not None else item)
+
+        return sample
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def to_dict(self):
+        wall = time.perf_counter() - self._wall
+        return {"argv": sys.argv,
+                "python": platform.python_version(),
+                "started": self.started,
+                "seconds": wall,
+                "cpu_seconds": time.process_time() - self._cpu,
+                "max_rss_kib": _max_rss_kib(),
+                "children_max_rss_kib": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+                "stages": dict((name, stage.to_dict()) for name, stage in self.stages.items()),
+                "counters": self.counters,
+                "samples": dict((name, sorted(summary.items(), key=lambda item: item[1], reverse=True))
+                                for name, summary in self.samples.items())}
+
+    def finish(self, path=None):
+        """Build the profile document, pass it to the hooks and write it to path as JSON if given"""
+        document = self.to_dict()
+        for hook in self.hooks:
+            hook("finish", None, document)
+        if path:
+            with open(path, "w") as f:
+                json.dump(document, f, indent=2)
+        return document
+
+
+class NullProfiler:
+    """Profiler interface that does nothing, used when profiling is off"""
+
+    enabled = False
+
+    @contextmanager
+    def stage(self, name, records=0):
+        yield None
+
+    def iterate(self, name, iterable, samplers=()):
+        return iterable
+
+    def instrument(self, obj, method, name=None):
+        return obj
+
+    def count(self, name, value):
+        pass
+
+    def sampler(self, name, every=100, capacity=20, key=None):
+        return None
+
+    def add_hook(self, hook):
+        pass
+
+    def finish(self, path=None):
+        return None
+
+
+NULL_PROFILER = NullProfiler()
@@ -0,0 +1,167 @@
+import csv
+import json
+import operator
+import sys
+
+# Breach records held by a sink before they are written out in one go
+BATCH_SIZE = 1000
+
+FIELDNAMES = ['username', 'password', 'Length', 'Capital', 'Lower', 'Digits', 'Symbols']
+
+# Broken rule labels in the order they are checked
+RULE_LABELS = ("too short", "too long", "no upper case", "no lower case", "no numbers", "non symbols", "in wordlist")
+
+
+class Reporter:
+    """Receives every policy breach of evaluate_password_health.
+
+    The base reporter only counts breaches and broken rules, which is all the quiet console mode
+    needs. Sinks buffer up to batch_size records and write them in one call, so no list of all
+    results is kept and the output stream is not written once per line.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.breaches = 0
+        self.rules = dict((label, 0) for label in RULE_LABELS)
+        self._pending = []
+
+    def breach(self, rules_dict, broken, score=None, failed=()):
+        """Report an account breaking the policy. rules_dict is the CSV row, broken the list of
+        broken rule labels, score the complexity score or None when only the length rule is broken,
+        failed the names of the policies it fails"""
+        self.breaches += 1
+        for label in broken:
+            self.rules[label] += 1
+        record = self.format(rules_dict, broken, score, failed)
+        if record is not None:
+            self._pending.append(record)
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def format(self, rules_dict, broken, score, failed):
+        """Return what is buffered for one breach, or None to buffer nothing"""
+        return None
+
+    def write(self, records):
+        pass
+
+    def flush(self):
+        if self._pending:
+            self.write(self._pending)
+            self._pending = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ConsoleReporter(Reporter):
+    """Prints every breach in the original evaluate_password_health format"""
+
+    def __init__(self, stream=None, batch_size=BATCH_SIZE):
+        Reporter.__init__(self, batch_size)
+        self.stream = stream
+
+    def format(self, rules_dict, broken, score, failed):
+        if score is None:
+            return "Policy breach, %s : %s %s\n" % (broken[0], rules_dict["username"], rules_dict["password"])
+        lines = ["================\nPolicy breach: %s:%s %s \n" % (rules_dict["username"], rules_dict["password"],
+                                                                   score)]
+        for el in broken:
+            lines.append("Broken Rule: %s\n" % el)
+        lines.append("================\n")
+        return "".join(lines)
+
+    def write(self, records):
+        (self.stream or sys.stdout).write("".join(records))
+
+
+class SummaryReporter(Reporter):
+    """Prints only the number of breaches and of broken rules once all accounts are checked"""
+
+    def __init__(self, stream=None, batch_size=BATCH_SIZE):
+        Reporter.__init__(self, batch_size)
+        self.stream = stream
+
+    def close(self):
+        stream = self.stream or sys.stdout
+        stream.write("\n[*] Policy breaches:\n")
+        stream.write("[+] %25s: %d\n" % ("accounts", self.breaches))
+        for label, count in self.rules.items():
+            stream.write("[+] %25s: %d\n" % (label, count))
+
+
+class CsvReporter(Reporter):
+    """Writes breaches as CSV rows with the rules_dict fields"""
+
+    def __init__(self, path, batch_size=BATCH_SIZE, fieldnames=FIELDNAMES):
+        Reporter.__init__(self, batch_size)
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(fieldnames)
+        self._row = operator.itemgetter(*fieldnames)
+
+    def format(self, rules_dict, broken, score, failed):
+        return self._row(rules_dict)
+
+    def write(self, records):
+        self.writer.writerows(records)
+
+    def close(self):
+        Reporter.close(self)
+        self.file.close()
+
+
+class JsonLinesReporter(Reporter):
+    """Writes one JSON object per breach, with the broken rules and complexity score"""
+
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        Reporter.__init__(self, batch_size)
+        self.file = open(path, 'w')
+
+    def format(self, rules_dict, broken, score, failed):
+        record = dict(rules_dict)
+        record["broken"] = broken
+        record["score"] = score
+        record["failed"] = list(failed)
+        return json.dumps(record) + "\n"
+
+    def write(self, records):
+        self.file.write("".join(records))
+
+    def close(self):
+        Reporter.close(self)
+        self.file.close()
+
+
+class MultiReporter(Reporter):
+    """Passes every breach on to several reporters, e.g. the console and a file, and counts them
+    like any reporter"""
+
+    def __init__(self, reporters):
+        Reporter.__init__(self)
+        self.reporters = reporters
+
+    def breach(self, rules_dict, broken, score=None, failed=()):
+        self.breaches += 1
+        for label in broken:
+            self.rules[label] += 1
+        for reporter in self.reporters:
+            reporter.breach(rules_dict, broken, score, failed)
+
+    def flush(self):
+        for reporter in self.reporters:
+            reporter.flush()
+
+    def close(self):
+        for reporter in self.reporters:
+            reporter.close()
+
+
+CONSOLE = {"full": ConsoleReporter, "summary": SummaryReporter, "quiet": Reporter}
@@ -0,0 +1,256 @@
+import argparse
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from analysiscache import AnalysisCache
+from policy import PolicySet, resolve_policies
+from strength import load_estimator
+from wordlist import WordlistIndex
+
+# Passwords accepted in one check request
+MAX_BATCH = 10000
+
+# Longest password checked; longer ones would hold the check lock for everyone
+MAX_PASSWORD_LENGTH = 256
+
+# Largest request body in bytes
+MAX_BODY = 4 * 1024 * 1024
+
+# Recent request latencies kept for the percentiles in /stats
+LATENCY_SAMPLES = 10000
+
+DEFAULT_PORT = 8787
+
+
+class PasswordChecker:
+    """Checks candidate passwords against policies, a wordlist index and the strength estimator,
+    with the same classification and rules as evaluate_password_health.
+
+    Everything is loaded once and shared by all requests. Checks run one batch at a time under a
+    lock, which keeps the cache and the counters consistent; a check is CPU bound, so threads
+    would not run them faster anyway.
+    """
+
+    def __init__(self, policies, wordlist=None, strength=None, cache_size=None):
+        self.policies = policies
+        self.wordlist = wordlist
+        self.strength = strength
+        self.cache = AnalysisCache(cache_size) if cache_size else AnalysisCache()
+        self.started = time.time()
+        self.requests = 0
+        self.passwords = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)  # seconds per check request
+        self._lock = threading.Lock()
+
+    def check(self, password):
+        """Return the result of one password as a dict, without the password"""
+        policies = self.policies
+        (flags, analysis) = self.cache.lookup(password)
+        listed = self.wordlist is not None and password in self.wordlist
+        bits = policies.evaluate(len(password), flags, listed)
+        result = {"ok": bits == policies.all,
+                  "failed": list(policies.names(policies.all & ~bits)),
+                  "broken": policies.broken_rules(len(password), flags, bits, listed) if bits != policies.all else [],
+                  "length": analysis[0],
+                  "charset": analysis[1],
+                  "mask": analysis[3]}
+        if self.wordlist is not None:
+            result["in_wordlist"] = listed
+        if self.strength is not None:
+            result["score"] = self.strength.score(password)
+        return result
+
+    def check_batch(self, passwords):
+        """Return the results of a list of passwords"""
+        with self._lock:
+            start = time.perf_counter()
+            results = [self.check(password) for password in passwords]
+            self.requests += 1
+            self.passwords += len(passwords)
+            self.latencies.append(time.perf_counter() - start)
+        return results
+
+    def error(self):
+        with self._lock:
+            self.errors += 1
+
+    def counters(self):
+        """Return the internal counters: requests, passwords, failures per policy, cache use and latency"""
+        with self._lock:
+            latencies = sorted(self.latencies)
+            checked, failures = self.policies.counts()
+            uptime = time.time() - self.started
+            counters = {"uptime_seconds": uptime,
+                        "requests": self.requests,
+                        "errors": self.errors,
+                        "passwords": self.passwords,
+                        "passwords_per_second": self.passwords / uptime if uptime else 0.0,
+                        "rejected": checked - self.policies.outcomes.get(self.policies.all, 0),
+                        "policy_failures": dict((policy.name, failed) for policy, failed
+                                                in zip(self.policies.policies, failures)),
+                        "cache_size": len(self.cache),
+                        "cache_hits": self.cache.hits,
+                        "cache_misses": self.cache.misses,
+                        "cache_hit_rate": self.cache.hit_rate(),
+                        "cache_evictions": self.cache.evictions}
+        if self.strength is not None:
+            counters["strength_cached"] = self.strength.cached
+        if latencies:
+            counters["latency_ms"] = dict(("p%d" % p, latencies[min(len(latencies) - 1, len(latencies) * p // 100)]
+                                           * 1000) for p in (50, 90, 99))
+            counters["latency_ms"]["max"] = latencies[-1] * 1000
+        return counters
+
+
+class CheckHandler(BaseHTTPRequestHandler):
+    """JSON over HTTP/1.1 with keep-alive:
+
+        POST /check     {"passwords": [...]} or {"password": "..."} -> {"results": [...]}
+        GET  /stats     internal counters
+        GET  /policies  the policies checked
+    """
+
+    protocol_version = "HTTP/1.1"
+    server_version = "password-health"
+    # Send headers and body in one write, flushed after every request, instead of waiting on delayed ACKs
+    wbufsize = -1
+
+    def _reply(self, status, document):
+        body = json.dumps(document).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _fail(self, status, message):
+        self.server.checker.error()
+        self._reply(status, {"error": message})
+
+    def do_GET(self):
+        checker = self.server.checker
+        if self.path == "/stats":
+            self._reply(200, checker.counters())
+        elif self.path == "/policies":
+            self._reply(200, {"policies": [policy.to_dict() for policy in checker.policies.policies],
+                              "wordlist": checker.wordlist.name if checker.wordlist is not None else None,
+                              "strength": checker.strength is not None})
+        else:
+            self._fail(404, "unknown path %s" % self.path)
+
+    def do_POST(self):
+        if self.path != "/check":
+            self._fail(404, "unknown path %s" % self.path)
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            # The body cannot be skipped without a valid length, so the connection cannot be reused
+            self.close_connection = True
+            self._fail(400, "bad Content-Length %s" % self.headers.get("Content-Length"))
+            return
+        if length > MAX_BODY:
+            self.close_connection = True
+            self._fail(413, "request larger than %d bytes" % MAX_BODY)
+            return
+        try:
+            request = json.loads(self.rfile.read(length).decode("utf-8"))
+            passwords = request["passwords"] if "passwords" in request else [request["password"]]
+            if not isinstance(passwords, list):
+                raise ValueError("passwords must be a list")
+            if not all(isinstance(password, str) for password in passwords):
+                raise ValueError("passwords must be strings")
+            if any(len(password) > MAX_PASSWORD_LENGTH for password in passwords):
+                raise ValueError("passwords must be at most %d characters" % MAX_PASSWORD_LENGTH)
+        except (ValueError, KeyError, TypeError) as e:
+            self._fail(400, "bad check request: %s" % e)
+            return
+        if len(passwords) > MAX_BATCH:
+            self._fail(413, "more than %d passwords in one request" % MAX_BATCH)
+            return
+        self._reply(200, {"results": self.server.checker.check_batch(passwords)})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else self.server.server_address
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(checker, socket_path=None, host="127.0.0.1", port=DEFAULT_PORT, verbose=False):
+    """Return a threaded HTTP server for checker on a Unix socket, replacing a stale socket file, or on
+    host and port"""
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = UnixHTTPServer(socket_path, CheckHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), CheckHandler)
+        server.daemon_threads = True
+    server.checker = checker
+    server.verbose = verbose
+    return server
+
+
+if __name__ == '__main__':
+    """Serve password checks with the rules of health.py, loaded once"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-N', '--number', default=8, type=int,
+                        help="Minimum length for the legacy-ad policy. Default is \033[0;0;92m8\033[0m")
+    parser.add_argument('--policy', nargs='+',
+                        help="Built-in policies (legacy-ad, ad-14, nist-800-63b) or JSON policy files to check. "
+                             "Default is \033[0;0;92mlegacy-ad\033[0m")
+    parser.add_argument('--wordlist', type=str, help="Wordlist index built with wordlist.py")
+    parser.add_argument('--strength', action='store_true', default=False,
+                        help="Add the 0-4 strength score to every result")
+    parser.add_argument('--strength-words', type=str, help="Ranked words for --strength instead of the built-in list")
+    parser.add_argument('--cache-size', type=int, help="Distinct passwords kept in the analysis cache")
+    parser.add_argument('--socket', type=str, help="Listen on this Unix socket instead of TCP")
+    parser.add_argument('--bind', default="127.0.0.1",
+                        help="Address to listen on. Default is \033[0;0;92m127.0.0.1\033[0m")
+    parser.add_argument('--port', default=DEFAULT_PORT, type=int,
+                        help="Port to listen on. Default is \033[0;0;92m%d\033[0m" % DEFAULT_PORT)
+    parser.add_argument('--verbose', action='store_true', default=False, help="Log every request")
+
+    args = parser.parse_args()
+    try:
+        policies = PolicySet(resolve_policies(args.policy or ["legacy-ad"], args.number))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        parser.error("invalid --policy: %s" % e)
+    wordlist = None
+    if args.wordlist:
+        try:
+            wordlist = WordlistIndex(args.wordlist)
+        except (OSError, ValueError) as e:
+            parser.error("invalid --wordlist: %s" % e)
+    strength = load_estimator(args.strength_words) if args.strength or args.strength_words else None
+    checker = PasswordChecker(policies, wordlist, strength, args.cache_size)
+    server = make_server(checker, args.socket, args.bind, args.port, args.verbose)
+    print("[*] Checking passwords against %s on %s" % (", ".join(policy.name for policy in policies.policies),
+                                                        args.socket or "http://%s:%d" % (args.bind, args.port)))
+    # Stop on SIGTERM like on Ctrl-C, removing the socket file
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
@@ -0,0 +1,175 @@
+import hashlib
+import heapq
+import math
+import operator
+
+# Rough memory of one tracked key in a SpaceSaving summary (key string, two dict slots, ints)
+ENTRY_BYTES = 256
+
+# Default HyperLogLog precision: 2^14 registers, 16 KiB, ~0.8% standard error
+HLL_PRECISION = 14
+
+
+def capacity_for_memory(mebibytes):
+    """Return the SpaceSaving capacity that stays within mebibytes, allowing for the 2x growth between prunes"""
+    return max(int(mebibytes * 1048576 // (2 * ENTRY_BYTES)), 1)
+
+
+class SpaceSaving:
+    """Bounded top-K frequency summary (Space-Saving with batched pruning).
+
+    Behaves like the {key: count} dicts of StatsGen, but keeps at most 2 * capacity keys. When it
+    grows past that, only the capacity most frequent keys are kept and the largest dropped count
+    becomes the floor: a key seen for the first time starts at the floor, because it may have been
+    dropped before. Every estimate is therefore at most error(key) above the true count, and any
+    key with a true count above the floor is tracked.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.floor = 0
+        self._counts = {}
+        self._errors = {}
+
+    @classmethod
+    def from_counts(cls, capacity, counts, errors, floor=0):
+        """Rebuild a summary from its (key, count) pairs, their errors and its floor, e.g. as saved in a
+        snapshot"""
+        summary = cls(capacity)
+        summary.floor = floor
+        for (key, count), error in zip(counts, errors):
+            summary._counts[key] = count
+            summary._errors[key] = error
+        return summary
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __iter__(self):
+        return iter(self._counts)
+
+    def __contains__(self, key):
+        return key in self._counts
+
+    def __getitem__(self, key):
+        return self._counts[key]
+
+    def __setitem__(self, key, count):
+        """Set the count of a tracked key; a new key is started at the floor plus count"""
+        if key in self._counts:
+            self._counts[key] = count
+            return
+        self._errors[key] = self.floor
+        self._counts[key] = self.floor + count
+        if len(self._counts) > 2 * self.capacity:
+            self._prune()
+
+    def __delitem__(self, key):
+        del self._counts[key]
+        del self._errors[key]
+
+    def get(self, key, default=None):
+        return self._counts.get(key, default)
+
+    def items(self):
+        return self._counts.items()
+
+    def keys(self):
+        return self._counts.keys()
+
+    def values(self):
+        return self._counts.values()
+
+    def add(self, key, count=1):
+        if key in self._counts:
+            self._counts[key] += count
+        else:
+            self[key] = count
+
+    def error(self, key):
+        """Maximum overestimate of the count of key"""
+        return self._errors.get(key, self.floor)
+
+    def max_error(self):
+        """Maximum overestimate of any count"""
+        return max(self._errors.values()) if self._errors else self.floor
+
+    def _prune(self):
+        keep = heapq.nlargest(self.capacity, self._counts.items(), key=operator.itemgetter(1))
+        kept = set(key for key, count in keep)
+        for key, count in self._counts.items():
+            if key not in kept and count > self.floor:
+                self.floor = count
+        # Rebuild in insertion order so ties keep sorting like the plain dicts
+        self._counts = dict((key, count) for key, count in self._counts.items() if key in kept)
+        self._errors = dict((key, self._errors[key]) for key in self._counts)
+
+    def merge(self, other):
+        """Add another summary, e.g. from a shard, into this one"""
+        for key, count in other.items():
+            if key in self._counts:
+                self._counts[key] += count
+                self._errors[key] += other.error(key)
+            else:
+                self._counts[key] = self.floor + count
+                self._errors[key] = self.floor + other.error(key)
+        for key in self._counts:
+            if key not in other:
+                self._counts[key] += other.floor
+                self._errors[key] += other.floor
+        self.floor += other.floor
+        if len(self._counts) > 2 * self.capacity:
+            self._prune()
+        return self
+
+
+def _hash64(item):
+    return int.from_bytes(hashlib.blake2b(item.encode("utf-8", "surrogatepass"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """Approximate distinct counter using 2^precision one-byte registers.
+
+    Hashing is deterministic, so counters built in different processes can be merged.
+    """
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    @classmethod
+    def from_registers(cls, registers):
+        """Rebuild a counter from its registers, e.g. as saved in a snapshot"""
+        counter = cls(len(registers).bit_length() - 1)
+        counter.registers = bytearray(registers)
+        return counter
+
+    def add(self, item):
+        h = _hash64(item)
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        """Return the estimated number of distinct items added"""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+    def error(self):
+        """Relative standard error of count"""
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def merge(self, other):
+        """Add another counter of the same precision into this one"""
+        if other.precision != self.precision:
+            raise ValueError("cannot merge HyperLogLog counters of precision %d and %d"
+                             % (self.precision, other.precision))
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
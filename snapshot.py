@@ -0,0 +1,285 @@
+import gzip
+import hashlib
+import json
+import os
+import struct
+import time
+from collections import Counter
+
+from potfile import complete_length
+from sketches import HyperLogLog, SpaceSaving
+from statsgen import StatsGen, analyze_codes
+
+MAGIC = b"PWHSNAP1"
+VERSION = 2
+
+# Strength score byte of accounts without one
+NO_SCORE = 255
+
+# Bytes at the start of the input hashed to notice a rewritten file
+PREFIX_SIZE = 65536
+
+# Per-account policy result bits
+LENGTH = 1
+CAPITAL = 2
+LOWER = 4
+DIGITS = 8
+SYMBOLS = 16
+BREACH = 32
+LISTED = 64  # password found in the wordlist index
+TOO_LONG = 128  # Length rule broken by a password over a maximum length
+
+# (rules_dict key, bit, label)
+RULES = (("Length", LENGTH, "too short"),
+         ("Length", TOO_LONG, "too long"),
+         ("Capital", CAPITAL, "no upper case"),
+         ("Lower", LOWER, "no lower case"),
+         ("Digits", DIGITS, "no numbers"),
+         ("Symbols", SYMBOLS, "no symbols"))
+
+_COUNTERS = ('stats_length', 'stats_charactersets', 'stats_simplemasks', 'stats_advancedmasks', 'stats_strength')
+_SCALARS = ('total_counter', 'filter_counter', 'wordlist_counter',
+            'mindigit', 'maxdigit', 'minupper', 'maxupper', 'minlower', 'maxlower', 'minspecial', 'maxspecial')
+
+
+def rules_flags(rules_dict, breached, listed=False, broken=()):
+    """Pack a rules_dict of evaluate_password_health into policy result bits. broken, the broken rule
+    labels, tells a password that is too long from one that is too short"""
+    flags = BREACH if breached else 0
+    if listed:
+        flags |= LISTED
+    for name, bit, label in RULES:
+        if name != "Length" and str(rules_dict[name]) == "0":
+            flags |= bit
+    if str(rules_dict["Length"]) == "0":
+        flags |= TOO_LONG if "too long" in broken else LENGTH
+    return flags
+
+
+def _prefix_digest(path, offset):
+    """Hash the first bytes of the already processed part of path"""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read(min(offset, PREFIX_SIZE))).hexdigest()
+
+
+def _stats_to_dict(stats):
+    state = dict((name, list(getattr(stats, name).items())) for name in _COUNTERS)
+    state.update((name, getattr(stats, name)) for name in _SCALARS)
+    if stats.sketch_capacity is not None:
+        masks = stats.stats_advancedmasks
+        state["sketch"] = {"capacity": stats.sketch_capacity,
+                           "floor": masks.floor,
+                           "errors": [masks.error(key) for key, count in state["stats_advancedmasks"]],
+                           "distinct_masks": stats.distinct_masks.registers.hex(),
+                           "distinct_passwords": stats.distinct_passwords.registers.hex()}
+    return state
+
+
+def _stats_from_dict(state):
+    stats = StatsGen()
+    for name in _COUNTERS:
+        setattr(stats, name, dict((key, count) for key, count in state.get(name, [])))
+    for name in _SCALARS:
+        setattr(stats, name, state.get(name, getattr(stats, name)))
+    sketch = state.get("sketch")
+    if sketch is not None:
+        # Restore the summary as it was, not through enable_sketches, which would start the errors
+        # and the distinct counts over
+        stats.sketch_capacity = sketch["capacity"]
+        stats.stats_advancedmasks = SpaceSaving.from_counts(sketch["capacity"], state["stats_advancedmasks"],
+                                                            sketch["errors"], sketch["floor"])
+        stats.distinct_masks = HyperLogLog.from_registers(bytes.fromhex(sketch["distinct_masks"]))
+        stats.distinct_passwords = HyperLogLog.from_registers(bytes.fromhex(sketch["distinct_passwords"]))
+    return stats
+
+
+class Snapshot:
+    """Persistent state of a run: StatsGen counters, per-account policy results and the input position.
+
+    Accounts are keyed by a salted BLAKE2b hash of the username, so the snapshot does not list
+    account names. Each account also keeps the class codes of its password (the letters of its
+    advanced mask) and its strength score, which lets the statistics drop the old password when an
+    account is re-cracked. The min/max complexity counters cannot be taken back and remain
+    high-water marks.
+
+    On disk a snapshot is gzip-compressed: MAGIC, a length-prefixed JSON header with the counters
+    (in sketch mode also the mask summary errors and the HyperLogLog registers),
+    then one 8-byte key, flags byte, score byte, 2-byte length and class codes per account. Version
+    1 snapshots have no score byte.
+    """
+
+    def __init__(self):
+        self.created = None
+        self.salt = os.urandom(16)
+        self.source = None
+        self.offset = 0
+        self.prefix = None
+        self.stats = StatsGen()
+        self.accounts = {}  # account key -> (policy result bits, class codes, strength score or None)
+
+    def clear(self):
+        """Forget all analysed input but keep the salt"""
+        self.offset = 0
+        self.prefix = None
+        self.stats = StatsGen()
+        self.accounts = {}
+
+    def account_key(self, username):
+        return hashlib.blake2b(username.encode("utf-8"), digest_size=8, key=self.salt).digest()
+
+    def resume(self, path):
+        """Return the (start, stop) byte range of path that still has to be analysed.
+
+        stop is the end of the file, see potfile.complete_length. Input that cannot be resumed (stdin,
+        compressed, a different file, or one that was truncated or rewritten) clears the snapshot and
+        is read in full, with stop None.
+        """
+        stop = complete_length(path) if path != "-" else None
+        source = os.path.abspath(path) if path != "-" else path
+        if stop is None or source != self.source or self.offset > stop or \
+                self.prefix != _prefix_digest(path, self.offset):
+            self.clear()
+        self.source = source
+        return (self.offset, stop) if stop is not None else (0, None)
+
+    def advance(self, path, stop):
+        """Mark path as analysed up to stop, as returned by resume"""
+        self.created = time.time()
+        self.offset = stop or 0
+        self.prefix = _prefix_digest(path, self.offset) if stop else None
+
+    def record(self, username, rules_dict, breached, analysis, listed=False, score=None, broken=()):
+        """Store the policy result of an account, replacing its previous password in the statistics.
+        broken is the list of broken rule labels of a breach"""
+        key = self.account_key(username)
+        old = self.accounts.get(key)
+        if old is not None and old[1]:
+            self._remove(analyze_codes(old[1]), bool(old[0] & LISTED), old[2])
+        self.accounts[key] = (rules_flags(rules_dict, breached, listed, broken), analysis[3][1::2], score)
+
+    def _remove(self, analysis, listed=False, score=None):
+        self.stats.add_analysis(analysis, -1, listed=listed, score=score)
+        for name, key in zip(_COUNTERS, analysis[:4] + (score,)):
+            counters = getattr(self.stats, name)
+            if counters.get(key) == 0:
+                del counters[key]
+
+    def policy_counts(self):
+        """Return the number of accounts, of breaching accounts and of accounts breaking each rule"""
+        counts = {"accounts": len(self.accounts), "breaches": 0, "in wordlist": 0}
+        counts.update((label, 0) for name, bit, label in RULES)
+        for flags, accounts in Counter(account[0] for account in self.accounts.values()).items():
+            if flags & BREACH:
+                counts["breaches"] += accounts
+            if flags & LISTED:
+                counts["in wordlist"] += accounts
+            for name, bit, label in RULES:
+                if flags & bit:
+                    counts[label] += accounts
+        return counts
+
+    def save(self, path):
+        """Write the snapshot to path, replacing it atomically"""
+        header = {"version": VERSION,
+                  "created": self.created,
+                  "salt": self.salt.hex(),
+                  "source": self.source,
+                  "offset": self.offset,
+                  "prefix": self.prefix,
+                  "stats": _stats_to_dict(self.stats),
+                  "accounts": len(self.accounts)}
+        data = json.dumps(header).encode("utf-8")
+        tmp = path + ".tmp"
+        with gzip.open(tmp, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack(">I", len(data)))
+            f.write(data)
+            buf = bytearray()
+            for key, (flags, codes, score) in self.accounts.items():
+                buf += key
+                buf += struct.pack(">BBH", flags, NO_SCORE if score is None else score, len(codes))
+                buf += codes.encode("ascii")
+                if len(buf) >= 1 << 20:
+                    f.write(buf)
+                    del buf[:]
+            f.write(buf)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a snapshot written by save"""
+        with gzip.open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("%s is not a password health snapshot" % path)
+            (size,) = struct.unpack(">I", f.read(4))
+            header = json.loads(f.read(size).decode("utf-8"))
+            if header["version"] not in (1, VERSION):
+                raise ValueError("%s has unsupported snapshot version %s" % (path, header["version"]))
+            data = f.read()
+
+        snapshot = cls()
+        snapshot.created = header["created"]
+        snapshot.salt = bytes.fromhex(header["salt"])
+        snapshot.source = header["source"]
+        snapshot.offset = header["offset"]
+        snapshot.prefix = header["prefix"]
+        snapshot.stats = _stats_from_dict(header["stats"])
+        accounts = snapshot.accounts
+        pos = 0
+        if header["version"] == 1:
+            while pos < len(data):
+                flags, length = struct.unpack_from(">BH", data, pos + 8)
+                accounts[data[pos:pos + 8]] = (flags, data[pos + 11:pos + 11 + length].decode("ascii"), None)
+                pos += 11 + length
+        while pos < len(data):
+            flags, score, length = struct.unpack_from(">BBH", data, pos + 8)
+            accounts[data[pos:pos + 8]] = (flags, data[pos + 12:pos + 12 + length].decode("ascii"),
+                                           None if score == NO_SCORE else score)
+            pos += 12 + length
+        return snapshot
+
+    def print_delta(self, old):
+        """Print how breach counts and the character-set and mask distributions changed since old"""
+        if old.created:
+            print("\n[*] Changes since %s:" % time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(old.created)))
+        else:
+            print("\n[*] Changes since snapshot:")
+        now = self.policy_counts()
+        before = old.policy_counts()
+        for label in ["accounts", "breaches"] + [label for name, bit, label in RULES] + ["in wordlist"]:
+            print("[+] %25s: %d (%+d)" % (label, now[label], now[label] - before[label]))
+
+        if self.salt == old.salt:
+            added = breaching = fixed = 0
+            for key, (flags, codes, score) in self.accounts.items():
+                previous = old.accounts.get(key)
+                if previous is None:
+                    added += 1
+                elif flags & BREACH and not previous[0] & BREACH:
+                    breaching += 1
+                elif previous[0] & BREACH and not flags & BREACH:
+                    fixed += 1
+            print("[+] %25s: %d" % ("new accounts", added))
+            print("[+] %25s: %d" % ("newly breaching", breaching))
+            print("[+] %25s: %d" % ("no longer breaching", fixed))
+
+        _print_distribution("Character-set", self.stats.stats_charactersets, self.stats.filter_counter,
+                            old.stats.stats_charactersets, old.stats.filter_counter)
+        _print_distribution("Simple Masks", self.stats.stats_simplemasks, self.stats.filter_counter,
+                            old.stats.stats_simplemasks, old.stats.filter_counter)
+        if self.stats.stats_strength or old.stats.stats_strength:
+            _print_distribution("Strength", self.stats.stats_strength, self.stats.filter_counter,
+                                old.stats.stats_strength, old.stats.filter_counter)
+        _print_distribution("Advanced Masks", self.stats.stats_advancedmasks, self.stats.filter_counter,
+                            old.stats.stats_advancedmasks, old.stats.filter_counter, limit=10)
+
+
+def _print_distribution(title, now, now_total, before, before_total, limit=None):
+    """Print share and count changes of a StatsGen counter, largest changes first"""
+    print("\n[*] %s changes:" % title)
+    keys = sorted(set(now) | set(before), key=lambda key: abs(now.get(key, 0) - before.get(key, 0)), reverse=True)
+    for key in keys[:limit]:
+        count = now.get(key, 0)
+        share = count * 100 // now_total if now_total else 0
+        previous = before.get(key, 0) * 100 // before_total if before_total else 0
+        print("[+] %25s: %02d%% (%+d%%) %d (%+d)" % (key, share, share - previous, count, count - before.get(key, 0)))
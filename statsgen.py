@@ -1,4 +1,149 @@
-import operator, string
+import multiprocessing
+import operator, re, string
+from collections import Counter, deque
+
+from sketches import HLL_PRECISION, HyperLogLog, SpaceSaving
+from strength import SCORE_LABELS, load_estimator
+from wordlist import open_index
+
+# Passwords per shard handed to a worker process in parallel mode
+SHARD_SIZE = 20000
+
+# Passwords classified together by generate_stats
+BATCH_SIZE = 2000
+
+# Distinct class code strings remembered by analyze_codes
+ANALYZED_SIZE = 100000
+_ANALYZED = dict()
+
+
+class _ClassTable(dict):
+    """ str.translate table mapping every character to its class code:
+
+        d  ASCII digit          l  ASCII lowercase      u  ASCII uppercase
+        s  non-word special     w  word special ('_' and non-ASCII letters)
+        n  non-ASCII decimal digit
+
+    w and n count as special in the statistics; they are kept apart so the same codes also
+    answer the \\d and \\W policy checks. Non-ASCII characters are added when first seen. """
+
+    def __missing__(self, key):
+        char = chr(key)
+        if char.isdecimal():
+            code = 'n'
+        elif char.isalnum():
+            code = 'w'
+        else:
+            code = 's'
+        self[key] = code
+        return code
+
+
+_CLASS_CODES = _ClassTable()
+_CLASS_CODES.update((ord(c), 'd') for c in string.digits)
+_CLASS_CODES.update((ord(c), 'l') for c in string.ascii_lowercase)
+_CLASS_CODES.update((ord(c), 'u') for c in string.ascii_uppercase)
+_CLASS_CODES[ord('_')] = 'w'
+
+# Same table keeping the newline that separates passwords in a batch
+_BATCH_CODES = _ClassTable(_CLASS_CODES)
+_BATCH_CODES[ord('\n')] = '\n'
+
+# Class codes to advanced mask
+_MASK_CODES = {ord('d'): '?d', ord('l'): '?l', ord('u'): '?u', ord('s'): '?s', ord('w'): '?s', ord('n'): '?s'}
+
+# Runs of digits, letters and specials in the class codes
+_SIMPLE_RUNS = re.compile(r'd+|[lu]+|[swn]+')
+_SIMPLE_NAMES = {'d': 'digit', 'l': 'string', 'u': 'string', 's': 'special', 'w': 'special', 'n': 'special'}
+
+# (digit, lower, upper, special) presence to character-set
+_CHARSETS = {
+    (True, False, False, False): 'numeric',
+    (False, True, False, False): 'loweralpha',
+    (False, False, True, False): 'upperalpha',
+    (False, False, False, True): 'special',
+
+    (False, True, True, False): 'mixedalpha',
+    (True, True, False, False): 'loweralphanum',
+    (True, False, True, False): 'upperalphanum',
+    (False, True, False, True): 'loweralphaspecial',
+    (False, False, True, True): 'upperalphaspecial',
+    (True, False, False, True): 'specialnum',
+
+    (False, True, True, True): 'mixedalphaspecial',
+    (True, False, True, True): 'upperalphaspecialnum',
+    (True, True, False, True): 'loweralphaspecialnum',
+    (True, True, True, False): 'mixedalphanum',
+}
+
+# Every character-set name, for the charsets filter
+CHARSETS = tuple(_CHARSETS.values()) + ('all',)
+
+
+def classify(password):
+    """ Return the class codes of password, one character per password character. """
+    return password.translate(_CLASS_CODES)
+
+
+def classify_batch(passwords):
+    """ Return the class codes of a list of passwords using one translate over the whole batch. """
+    joined = '\n'.join(passwords)
+    if joined.count('\n') != len(passwords) - 1 or not passwords:
+        return [password.translate(_CLASS_CODES) for password in passwords]
+    return joined.translate(_BATCH_CODES).split('\n')
+
+
+def analyze_codes(codes):
+    """ Build the analyze_password tuple from the class codes of a password. Every field
+    depends only on the codes, so results are memoized per code string. """
+
+    try:
+        return _ANALYZED[codes]
+    except KeyError:
+        pass
+
+    # Password length
+    pass_length = len(codes)
+
+    # Character-set and policy counters
+    digit = codes.count('d')
+    lower = codes.count('l')
+    upper = codes.count('u')
+    special = pass_length - digit - lower - upper
+
+    # String representation of masks
+    advancedmask_string = codes.translate(_MASK_CODES)
+    runs = _SIMPLE_RUNS.findall(codes)
+    simplemask_string = ''.join([_SIMPLE_NAMES[run[0]] for run in runs]) if len(runs) <= 3 else 'othermask'
+
+    # Policy
+    policy = (digit, lower, upper, special)
+
+    # Determine character-set
+    charset = _CHARSETS.get((digit > 0, lower > 0, upper > 0, special > 0), 'all')
+
+    if len(_ANALYZED) >= ANALYZED_SIZE:
+        _ANALYZED.clear()
+    analysis = _ANALYZED[codes] = (pass_length, charset, simplemask_string, advancedmask_string, policy)
+    return analysis
+
+
+def _stats_worker(shard):
+    """ Build a partial StatsGen for one shard of passwords in a worker process. """
+    filters, passwords = shard
+    stats = StatsGen()
+    (stats.minlength, stats.maxlength, stats.simplemasks, stats.charsets, sketch_capacity, wordlist, strength) = filters
+    if sketch_capacity:
+        stats.enable_sketches(sketch_capacity)
+    if wordlist:
+        stats.wordlist = open_index(wordlist)
+    if strength is not False:
+        stats.strength = load_estimator(strength)
+    stats.add_passwords(passwords)
+    # The mmap'd index and the estimator's tables stay in the worker
+    stats.wordlist = None
+    stats.strength = None
+    return stats
 
 
 class StatsGen:
@@ -13,6 +158,9 @@ class StatsGen:
         self.quiet = False
         self.debug = True
 
+        # Optional shared AnalysisCache (see analysiscache.py) used instead of analyzing every password
+        self.cache = None
+
         # Stats dictionaries
         self.stats_length = dict()
         self.stats_simplemasks = dict()
@@ -36,159 +184,235 @@ class StatsGen:
         self.maxlower = None
         self.maxspecial = None
 
-    def analyze_password(self, password):
+        # Optional wordlist.WordlistIndex; passwords found in it are counted in wordlist_counter
+        self.wordlist = None
+        self.wordlist_counter = 0
+
+        # Optional strength.Estimator; passwords are counted per score in stats_strength
+        self.strength = None
+        self.stats_strength = dict()
 
-        # Password length
-        pass_length = len(password)
+        # Sketch mode, see enable_sketches
+        self.sketch_capacity = None
+        self.distinct_masks = None
+        self.distinct_passwords = None
 
-        # Character-set and policy counters
-        digit = 0
-        lower = 0
-        upper = 0
-        special = 0
+    def enable_sketches(self, capacity, precision=HLL_PRECISION):
+        """ Keep memory flat on huge inputs: track advanced masks in a SpaceSaving top-K summary of the
+        given capacity instead of a dict, and count distinct masks and passwords with HyperLogLogs.
+        Length, character-set and simple mask counters have a small fixed set of keys and stay exact. """
 
-        simplemask = list()
-        advancedmask_string = ""
+        masks = self.stats_advancedmasks
+        self.sketch_capacity = capacity
+        self.stats_advancedmasks = SpaceSaving(capacity)
+        self.distinct_masks = HyperLogLog(precision)
+        self.distinct_passwords = HyperLogLog(precision)
 
-        # Detect simple and advanced masks
-        for letter in password:
+        # Carry over counts gathered before, e.g. loaded from a snapshot
+        for (advancedmask, count) in masks.items():
+            self.stats_advancedmasks.add(advancedmask, count)
+            self.distinct_masks.add(advancedmask)
 
-            if letter in string.digits:
-                digit += 1
-                advancedmask_string += "?d"
-                if not simplemask or not simplemask[-1] == 'digit': simplemask.append('digit')
+    def analyze_password(self, password):
 
-            elif letter in string.lowercase:
-                lower += 1
-                advancedmask_string += "?l"
-                if not simplemask or not simplemask[-1] == 'string': simplemask.append('string')
+        # Class code per character, e.g. 'Pass1!' -> 'ulllds'
+        return analyze_codes(classify(password))
 
+    def analyze_batch(self, passwords):
+        """ Analyze a list of passwords at once, returning the same tuples as analyze_password.
+        The whole batch is classified with a single str.translate call over the joined passwords. """
 
-            elif letter in string.uppercase:
-                upper += 1
-                advancedmask_string += "?u"
-                if not simplemask or not simplemask[-1] == 'string': simplemask.append('string')
+        return [analyze_codes(codes) for codes in classify_batch(passwords)]
 
-            else:
-                special += 1
-                advancedmask_string += "?s"
-                if not simplemask or not simplemask[-1] == 'special': simplemask.append('special')
-
-        # String representation of masks
-        simplemask_string = ''.join(simplemask) if len(simplemask) <= 3 else 'othermask'
-
-        # Policy
-        policy = (digit, lower, upper, special)
-
-        # Determine character-set
-        if digit and not lower and not upper and not special:
-            charset = 'numeric'
-        elif not digit and lower and not upper and not special:
-            charset = 'loweralpha'
-        elif not digit and not lower and upper and not special:
-            charset = 'upperalpha'
-        elif not digit and not lower and not upper and special:
-            charset = 'special'
-
-        elif not digit and lower and upper and not special:
-            charset = 'mixedalpha'
-        elif digit and lower and not upper and not special:
-            charset = 'loweralphanum'
-        elif digit and not lower and upper and not special:
-            charset = 'upperalphanum'
-        elif not digit and lower and not upper and special:
-            charset = 'loweralphaspecial'
-        elif not digit and not lower and upper and special:
-            charset = 'upperalphaspecial'
-        elif digit and not lower and not upper and special:
-            charset = 'specialnum'
-
-        elif not digit and lower and upper and special:
-            charset = 'mixedalphaspecial'
-        elif digit and not lower and upper and special:
-            charset = 'upperalphaspecialnum'
-        elif digit and lower and not upper and special:
-            charset = 'loweralphaspecialnum'
-        elif digit and lower and upper and not special:
-            charset = 'mixedalphanum'
+    def add_password(self, password):
+        """ Add a single password to the statistics. """
+        password = password.rstrip('\r\n')
+
+        if len(password) == 0: return
+
+        if self.cache is not None:
+            self.add_analysis(self.cache.analysis(password))
         else:
-            charset = 'all'
+            self.add_analysis(self.analyze_password(password))
 
-        return (pass_length, charset, simplemask_string, advancedmask_string, policy)
+    def add_passwords(self, passwords):
+        """ Add a batch of passwords to the statistics. Each distinct password is analyzed once
+        and counted as many times as it occurs. """
+        counts = Counter(password for password in (password.rstrip('\r\n') for password in passwords) if password)
+        distinct = list(counts)
+        weights = list(counts.values())
 
-    def generate_stats(self, password_dict):
-        """ Generate password statistics. """
+        if self.cache is not None:
+            analyses = self.cache.analysis_batch(distinct, weights)
+        else:
+            analyses = self.analyze_batch(distinct)
 
-        for username,password in password_dict.items():
-            password = password.rstrip('\r\n')
+        for password, analysis, count in zip(distinct, analyses, weights):
+            self.add_analysis(analysis, count, password)
 
-            if len(password) == 0: continue
+    def add_analysis(self, analysis, count=1, password=None, listed=None, score=None):
+        """ Add the result of analyze_password to the statistics, weighted by count occurrences. The
+        password itself is only needed for the distinct password count in sketch mode, to look it up
+        in the wordlist and to estimate its strength, unless listed and score already give those. """
 
-            self.total_counter += 1
+        self.total_counter += count
 
-            (pass_length, characterset, simplemask, advancedmask, policy) = self.analyze_password(password)
-            (digit, lower, upper, special) = policy
+        if self.distinct_passwords is not None and password is not None:
+            self.distinct_passwords.add(password)
 
-            if (self.charsets == None or characterset in self.charsets) and \
-                    (self.simplemasks == None or simplemask in self.simplemasks) and \
-                    (self.maxlength == None or pass_length <= self.maxlength) and \
-                    (self.minlength == None or pass_length >= self.minlength):
+        (pass_length, characterset, simplemask, advancedmask, policy) = analysis
+        (digit, lower, upper, special) = policy
 
-                self.filter_counter += 1
+        if (self.charsets == None or characterset in self.charsets) and \
+                (self.simplemasks == None or simplemask in self.simplemasks) and \
+                (self.maxlength == None or pass_length <= self.maxlength) and \
+                (self.minlength == None or pass_length >= self.minlength):
 
-                if self.mindigit == None or digit < self.mindigit: self.mindigit = digit
-                if self.maxdigit == None or digit > self.maxdigit: self.maxdigit = digit
+            self.filter_counter += count
 
-                if self.minupper == None or upper < self.minupper: self.minupper = upper
-                if self.maxupper == None or upper > self.maxupper: self.maxupper = upper
+            if listed is None and self.wordlist is not None and password is not None:
+                listed = password in self.wordlist
+            if listed:
+                self.wordlist_counter += count
 
-                if self.minlower == None or lower < self.minlower: self.minlower = lower
-                if self.maxlower == None or lower > self.maxlower: self.maxlower = lower
+            if score is None and self.strength is not None and password is not None:
+                score = self.strength.score(password)
+            if score is not None:
+                self.stats_strength[score] = self.stats_strength.get(score, 0) + count
 
-                if self.minspecial == None or special < self.minspecial: self.minspecial = special
-                if self.maxspecial == None or special > self.maxspecial: self.maxspecial = special
+            if self.mindigit == None or digit < self.mindigit: self.mindigit = digit
+            if self.maxdigit == None or digit > self.maxdigit: self.maxdigit = digit
 
-                if pass_length in self.stats_length:
-                    self.stats_length[pass_length] += 1
-                else:
-                    self.stats_length[pass_length] = 1
+            if self.minupper == None or upper < self.minupper: self.minupper = upper
+            if self.maxupper == None or upper > self.maxupper: self.maxupper = upper
 
-                if characterset in self.stats_charactersets:
-                    self.stats_charactersets[characterset] += 1
-                else:
-                    self.stats_charactersets[characterset] = 1
+            if self.minlower == None or lower < self.minlower: self.minlower = lower
+            if self.maxlower == None or lower > self.maxlower: self.maxlower = lower
 
-                if simplemask in self.stats_simplemasks:
-                    self.stats_simplemasks[simplemask] += 1
-                else:
-                    self.stats_simplemasks[simplemask] = 1
+            if self.minspecial == None or special < self.minspecial: self.minspecial = special
+            if self.maxspecial == None or special > self.maxspecial: self.maxspecial = special
 
-                if advancedmask in self.stats_advancedmasks:
-                    self.stats_advancedmasks[advancedmask] += 1
-                else:
-                    self.stats_advancedmasks[advancedmask] = 1
+            if pass_length in self.stats_length:
+                self.stats_length[pass_length] += count
+            else:
+                self.stats_length[pass_length] = count
 
+            if characterset in self.stats_charactersets:
+                self.stats_charactersets[characterset] += count
+            else:
+                self.stats_charactersets[characterset] = count
+
+            if simplemask in self.stats_simplemasks:
+                self.stats_simplemasks[simplemask] += count
+            else:
+                self.stats_simplemasks[simplemask] = count
+
+            if self.distinct_masks is not None and advancedmask not in self.stats_advancedmasks:
+                self.distinct_masks.add(advancedmask)
+
+            if advancedmask in self.stats_advancedmasks:
+                self.stats_advancedmasks[advancedmask] += count
+            else:
+                self.stats_advancedmasks[advancedmask] = count
+
+    def generate_stats(self, password_dict, jobs=1):
+        """ Generate password statistics from a {username: password} dict or an iterable of
+        (username, password) records, which is consumed lazily. With jobs > 1 the passwords
+        are sharded over a process pool. """
+
+        records = password_dict.items() if hasattr(password_dict, 'items') else password_dict
+        if jobs > 1:
+            for record in self.iter_parallel(records, jobs):
+                pass
+            return
+        batch = []
+        for username, password in records:
+            batch.append(password)
+            if len(batch) >= BATCH_SIZE:
+                self.add_passwords(batch)
+                batch = []
+        self.add_passwords(batch)
+
+    def iter_parallel(self, records, jobs, shard_size=SHARD_SIZE):
+        """ Pass (username, password) records through while their passwords are analyzed in
+        shards by a pool of jobs worker processes. Partial results are merged back in input
+        order, so the final statistics are identical to a single-process run. """
+
+        filters = (self.minlength, self.maxlength, self.simplemasks, self.charsets, self.sketch_capacity,
+                   self.wordlist.path if self.wordlist is not None else None,
+                   self.strength.source if self.strength is not None else False)
+        pool = multiprocessing.Pool(jobs)
+        pending = deque()
+        shard = []
+        try:
+            for record in records:
+                shard.append(record[1])
+                if len(shard) >= shard_size:
+                    pending.append(pool.apply_async(_stats_worker, ((filters, shard),)))
+                    shard = []
+                    # Merge finished shards early and stop reading ahead of busy workers
+                    while pending and (pending[0].ready() or len(pending) > jobs * 2):
+                        self.merge(pending.popleft().get())
+                yield record
+            if shard:
+                pending.append(pool.apply_async(_stats_worker, ((filters, shard),)))
+            while pending:
+                self.merge(pending.popleft().get())
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def merge(self, other):
+        """ Add the counters of another StatsGen, e.g. a partial result of a shard, into this one. """
+
+        self.total_counter += other.total_counter
+        self.filter_counter += other.filter_counter
+        self.wordlist_counter += other.wordlist_counter
+
+        for name in ('stats_length', 'stats_charactersets', 'stats_simplemasks', 'stats_advancedmasks',
+                     'stats_strength'):
+            counters = getattr(self, name)
+            if isinstance(counters, SpaceSaving) and isinstance(getattr(other, name), SpaceSaving):
+                counters.merge(getattr(other, name))
+                continue
+            for key, count in getattr(other, name).items():
+                counters[key] = counters.get(key, 0) + count
+
+        for name in ('distinct_masks', 'distinct_passwords'):
+            if getattr(self, name) is not None and getattr(other, name) is not None:
+                getattr(self, name).merge(getattr(other, name))
+
+        for name in ('digit', 'upper', 'lower', 'special'):
+            theirs = getattr(other, 'min' + name)
+            if theirs != None and (getattr(self, 'min' + name) == None or theirs < getattr(self, 'min' + name)):
+                setattr(self, 'min' + name, theirs)
+            theirs = getattr(other, 'max' + name)
+            if theirs != None and (getattr(self, 'max' + name) == None or theirs > getattr(self, 'max' + name)):
+                setattr(self, 'max' + name, theirs)
+
+        return self
 
     def print_stats(self):
         """ Print password statistics. """
 
         print("[+] Analyzing %d%% (%d/%d) of passwords" % (
-            self.filter_counter * 100 / self.total_counter, self.filter_counter, self.total_counter))
+            self.filter_counter * 100 // self.total_counter, self.filter_counter, self.total_counter))
         print(
             "    NOTE: Statistics below is relative to the number of analyzed passwords, not total number of passwords")
         print(
             "\n[*] Length:")
-        for (length, count) in sorted(self.stats_length.iteritems(), key=operator.itemgetter(1), reverse=True):
-            if self.hiderare and not count * 100 / self.filter_counter > 0: continue
+        for (length, count) in sorted(self.stats_length.items(), key=operator.itemgetter(1), reverse=True):
+            if self.hiderare and not count * 100 // self.filter_counter > 0: continue
             print(
-                "[+] %25d: %02d%% (%d)" % (length, count * 100 / self.filter_counter, count))
+                "[+] %25d: %02d%% (%d)" % (length, count * 100 // self.filter_counter, count))
 
         print(
             "\n[*] Character-set:")
-        for (char, count) in sorted(self.stats_charactersets.iteritems(), key=operator.itemgetter(1), reverse=True):
-            if self.hiderare and not count * 100 / self.filter_counter > 0: continue
+        for (char, count) in sorted(self.stats_charactersets.items(), key=operator.itemgetter(1), reverse=True):
+            if self.hiderare and not count * 100 // self.filter_counter > 0: continue
             print(
-                "[+] %25s: %02d%% (%d)" % (char, count * 100 / self.filter_counter, count))
+                "[+] %25s: %02d%% (%d)" % (char, count * 100 // self.filter_counter, count))
 
         print(
             "\n[*] Password complexity:")
@@ -201,20 +425,41 @@ class StatsGen:
         print(
             "[+]                   special: min(%s) max(%s)" % (self.minspecial, self.maxspecial))
 
+        if self.wordlist is not None or self.wordlist_counter:
+            print(
+                "\n[*] Wordlist:")
+            print(
+                "[+] %25s: %02d%% (%d)" % (self.wordlist.name if self.wordlist is not None else "in wordlist",
+                                          self.wordlist_counter * 100 // self.filter_counter, self.wordlist_counter))
+
+        if self.stats_strength:
+            print(
+                "\n[*] Strength:")
+            for (score, count) in sorted(self.stats_strength.items()):
+                print(
+                    "[+] %25s: %02d%% (%d)" % (SCORE_LABELS[score], count * 100 // self.filter_counter, count))
+
         print(
             "\n[*] Simple Masks:")
-        for (simplemask, count) in sorted(self.stats_simplemasks.iteritems(), key=operator.itemgetter(1), reverse=True):
-            if self.hiderare and not count * 100 / self.filter_counter > 0: continue
+        for (simplemask, count) in sorted(self.stats_simplemasks.items(), key=operator.itemgetter(1), reverse=True):
+            if self.hiderare and not count * 100 // self.filter_counter > 0: continue
             print(
-                "[+] %25s: %02d%% (%d)" % (simplemask, count * 100 / self.filter_counter, count))
+                "[+] %25s: %02d%% (%d)" % (simplemask, count * 100 // self.filter_counter, count))
 
         print(
             "\n[*] Advanced Masks:")
-        for (advancedmask, count) in sorted(self.stats_advancedmasks.iteritems(), key=operator.itemgetter(1),
+        if self.distinct_masks is not None:
+            print(
+                "[+] %25s: ~%d (+-%.1f%%)" % ("distinct masks", self.distinct_masks.count(), self.distinct_masks.error() * 100))
+            print(
+                "[+] %25s: ~%d (+-%.1f%%)" % ("distinct passwords", self.distinct_passwords.count(), self.distinct_passwords.error() * 100))
+            print(
+                "[+] %25s: top %d, counts at most %d too high" % ("approximate", self.sketch_capacity, self.stats_advancedmasks.max_error()))
+        for (advancedmask, count) in sorted(self.stats_advancedmasks.items(), key=operator.itemgetter(1),
                                             reverse=True):
-            if count * 100 / self.filter_counter > 0:
+            if count * 100 // self.filter_counter > 0:
                 print(
-                    "[+] %25s: %02d%% (%d)" % (advancedmask, count * 100 / self.filter_counter, count))
+                    "[+] %25s: %02d%% (%d)" % (advancedmask, count * 100 // self.filter_counter, count))
 
             if self.output_file:
                 self.output_file.write("%s,%d\n" % (advancedmask, count))
@@ -0,0 +1,369 @@
+import math
+import re
+import time
+from collections import OrderedDict
+
+from potfile import iter_lines
+
+# Distinct passwords whose estimate is kept
+CACHE_SIZE = 200000
+
+# Years are guessed relative to this one
+REFERENCE_YEAR = time.localtime().tm_year
+MIN_YEAR_SPACE = 20
+
+# Guesses of a brute-forced character, and the minimum for one- and multi-character leftovers
+BRUTEFORCE_CARDINALITY = 10
+MIN_GUESSES_SINGLE_CHAR = 10
+MIN_GUESSES_MULTI_CHAR = 50
+
+# Longer passwords are not searched for patterns and count as brute-forced, like zxcvbn's
+# length limit; their guesses are those of MAX_SCORED_LENGTH brute-forced characters
+MAX_SCORED_LENGTH = 100
+
+# Penalty for splitting a password into more matches, as in zxcvbn
+MIN_GUESSES_BEFORE_GROWING_SEQUENCE = 10000
+
+# Upper bounds of guesses for scores 0 to 3; anything above scores 4
+SCORE_GUESSES = (10 ** 3 + 5, 10 ** 6 + 5, 10 ** 8 + 5, 10 ** 10 + 5)
+SCORE_LABELS = ("0 too guessable", "1 very guessable", "2 somewhat guessable", "3 safely unguessable",
+                "4 very unguessable")
+
+# Most common passwords and password words, most frequent first; the rank is the guess count
+COMMON_WORDS = """
+password 123456 qwerty dragon baseball football letmein monkey abc shadow master
+mustang michael superman trustno jordan jennifer hunter buster soccer harley batman andrew tigger
+sunshine iloveyou charlie robert thomas hockey ranger daniel starwars george computer michelle jessica
+pepper freedom maggie ginger princess joshua cheese amanda summer love ashley nicole chelsea biteme
+matthew access yankees dallas austin thunder taylor matrix william corvette hello martin heather secret
+merlin diamond hammer silver anthony justin test bailey cookie orange bandit welcome winter spring
+autumn fall admin administrator changeme company london paris berlin madrid login pass qwer asdf zxcv
+flower football1 killer purple jordan23 samsung apple google microsoft windows linux oracle cisco
+server network system default guest user root toor manager office account service support backup
+monday tuesday wednesday thursday friday saturday sunday january february march april may june july
+august september october november december spring summer winter christmas easter holiday family
+friend friends forever angel angels baby babygirl lovely beautiful blessed jesus god heaven
+tiger lion eagle falcon wolf bear shark snake horse dog cat bird fish dolphin panther phoenix
+red blue green black white yellow pink gold golden star stars moon sun sky ocean river mountain
+happy lucky magic power money rich cash king queen prince boss super best great cool sweet
+pizza coffee chocolate banana cherry lemon sugar honey cream candy
+john mary james linda susan karen david lisa sarah emma olivia sophia chris alex sam mike kevin
+brian jason steven paul mark peter richard joseph charles donald kenneth edward ronald anna maria
+""".split()
+
+# Character substitutions undone before dictionary lookups
+LEET = {"4": "a", "@": "a", "8": "b", "(": "c", "{": "c", "[": "c", "<": "c", "3": "e", "6": "g",
+        "9": "g", "1": "il", "!": "i", "|": "il", "0": "o", "$": "s", "5": "s", "7": "lt", "+": "t",
+        "%": "x", "2": "z"}
+
+# Keyboard rows (unshifted, shifted) with the column of their first key; rows below sit half a key right
+QWERTY = (("`1234567890-=", "~!@#$%^&*()_+", 0),
+          ("qwertyuiop[]\\", "QWERTYUIOP{}|", 1),
+          ("asdfghjkl;'", "ASDFGHJKL:\"", 1),
+          ("zxcvbnm,./", "ZXCVBNM<>?", 1))
+
+# Neighbour offsets on the slanted grid: left, right, up-left, up-right, down-left, down-right
+_DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (1, -1), (-1, 1), (0, 1))
+
+_END = None
+
+_YEAR = re.compile(r"19\d\d|20\d\d")
+_DATE_SEPARATED = re.compile(r"(\d{1,4})([\s/\\_.-])(\d{1,2})\2(\d{1,4})")
+_DIGITS = re.compile(r"\d{4,8}")
+_REPEAT = re.compile(r"(.+?)\1+")
+
+
+def _keyboard_graph():
+    """Return {key: {neighbour key: direction}} for the qwerty layout, with shifted keys mapped to their key"""
+    positions = {}
+    unshift = {}
+    for y, (keys, shifted, offset) in enumerate(QWERTY):
+        for x, (key, shift) in enumerate(zip(keys, shifted)):
+            positions[(x + offset, y)] = key
+            unshift[key] = key
+            unshift[shift] = key
+    graph = {}
+    for (x, y), key in positions.items():
+        graph[key] = dict((positions[(x + dx, y + dy)], direction)
+                          for direction, (dx, dy) in enumerate(_DIRECTIONS) if (x + dx, y + dy) in positions)
+    return graph, unshift
+
+
+def _uppercase_variations(word):
+    """Guess multiplier for the capitalization of a matched word"""
+    upper = sum(1 for c in word if c.isupper())
+    if upper == 0:
+        return 1
+    lower = sum(1 for c in word if c.islower())
+    if lower == 0 or (upper == 1 and (word[0].isupper() or word[-1].isupper())):
+        return 2
+    return sum(math.comb(upper + lower, i) for i in range(1, min(upper, lower) + 1))
+
+
+def _year_guesses(year):
+    return max(abs(year - REFERENCE_YEAR), MIN_YEAR_SPACE)
+
+
+def _full_year(year):
+    if year > 99:
+        return year
+    return year + (1900 if year > 50 else 2000)
+
+
+def _valid_date(parts):
+    """Return the year if the three numbers can be read as a day, month and year in a common order"""
+    for (day, month, year) in ((parts[0], parts[1], parts[2]), (parts[1], parts[0], parts[2]),
+                               (parts[2], parts[1], parts[0])):
+        year = _full_year(year)
+        if 1 <= day <= 31 and 1 <= month <= 12 and 1900 <= year <= 2099:
+            return year
+    return None
+
+
+class Estimator:
+    """zxcvbn-style estimate of how many guesses a password takes to crack.
+
+    The password is scanned for dictionary words (also with leetspeak undone, via a trie built
+    once), keyboard walks, character sequences, repeats, years and dates. Each match gets a guess
+    count, and the cheapest way to cover the whole password with matches and brute-forced
+    leftovers is found with zxcvbn's dynamic program. Estimates of distinct passwords are cached,
+    so accounts sharing a password cost a dictionary lookup.
+    """
+
+    def __init__(self, words=None, cache_size=CACHE_SIZE):
+        self.source = words
+        self.trie = {}
+        for rank, word in enumerate(self._read_words(words), 1):
+            node = self.trie
+            for c in word:
+                node = node.setdefault(c, {})
+            if _END not in node:
+                node[_END] = rank
+        self.graph, self.unshift = _keyboard_graph()
+        self.average_degree = float(sum(len(neighbours) for neighbours in self.graph.values())) / len(self.graph)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    @property
+    def cached(self):
+        """Number of distinct passwords whose estimate is cached"""
+        return len(self._cache)
+
+    @staticmethod
+    def _read_words(words):
+        """Ranked words: the built-in list, or a file of one word per line, most common first"""
+        if words is None:
+            return COMMON_WORDS
+        return [word.lower() for word in iter_lines(words) if word]
+
+    def estimate(self, password):
+        """Return (guesses, score 0-4) of password"""
+        result = self._cache.get(password)
+        if result is None:
+            guesses = self.guesses(password)
+            score = 0
+            while score < len(SCORE_GUESSES) and guesses >= SCORE_GUESSES[score]:
+                score += 1
+            result = self._cache[password] = (guesses, score)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(password)
+        return result
+
+    def score(self, password):
+        return self.estimate(password)[1]
+
+    def guesses(self, password):
+        """Return the estimated guess count of password"""
+        n = len(password)
+        if n == 0:
+            return 1
+        if n > MAX_SCORED_LENGTH:
+            return BRUTEFORCE_CARDINALITY ** MAX_SCORED_LENGTH
+        matches = self._matches(password)
+
+        # Leftovers are brute-forced between adjacent match boundaries only, so the matches grow
+        # linearly with the boundaries; consecutive brute-forced pieces are merged into one match
+        # below, which gives the same result as brute-forcing any span between boundaries
+        bounds = set((0, n))
+        for start, end, guesses in matches:
+            bounds.add(start)
+            bounds.add(end)
+        bounds = sorted(bounds)
+        by_end = [[] for _ in range(n + 1)]
+        for start, end, guesses in matches:
+            by_end[end].append((start, guesses, False))
+        for start, end in zip(bounds, bounds[1:]):
+            by_end[end].append((start, BRUTEFORCE_CARDINALITY ** (end - start), True))
+
+        # optimal[position] = {(number of matches, ends brute-forced): smallest product of their guesses
+        # covering password[:position]}
+        optimal = [None] * (n + 1)
+        optimal[0] = {(0, False): 1}
+        for end in range(1, n + 1):
+            best = {}
+            for start, guesses, brute in by_end[end]:
+                if optimal[start] is None:
+                    continue
+                for (count, extends), product in optimal[start].items():
+                    if brute and extends:
+                        key = (count, True)
+                    else:
+                        key = (count + 1, brute)
+                    if brute and not extends:
+                        minimum = MIN_GUESSES_SINGLE_CHAR if end - start == 1 else MIN_GUESSES_MULTI_CHAR
+                        product *= max(guesses, minimum)
+                    else:
+                        product *= guesses
+                    if product < best.get(key, product + 1):
+                        best[key] = product
+            optimal[end] = best or None
+
+        return min(math.factorial(count) * product + MIN_GUESSES_BEFORE_GROWING_SEQUENCE ** (count - 1)
+                   for (count, extends), product in optimal[n].items())
+
+    def _matches(self, password):
+        """Return (start, end, guesses) of every pattern found in password"""
+        matches = []
+        self._dictionary(password, matches)
+        self._spatial(password, matches)
+        self._sequences(password, matches)
+        self._repeats(password, matches)
+        self._dates(password, matches)
+        return matches
+
+    def _dictionary(self, password, matches):
+        lower = password.lower()
+        n = len(lower)
+        for i in range(n):
+            states = [(self.trie, 0)]  # trie node, substitutions made
+            for j in range(i, n):
+                c = lower[j]
+                advanced = []
+                for node, subs in states:
+                    child = node.get(c)
+                    if child is not None:
+                        advanced.append((child, subs))
+                    for plain in LEET.get(c, ""):
+                        child = node.get(plain)
+                        if child is not None:
+                            advanced.append((child, subs + 1))
+                if not advanced:
+                    break
+                states = advanced
+                for node, subs in states:
+                    rank = node.get(_END)
+                    if rank is not None:
+                        variations = _uppercase_variations(password[i:j + 1]) * (2 ** subs if subs else 1)
+                        matches.append((i, j + 1, max(rank * variations, MIN_GUESSES_MULTI_CHAR if j > i else 1)))
+
+    def _spatial(self, password, matches):
+        graph, unshift = self.graph, self.unshift
+        n = len(password)
+        i = 0
+        while i < n - 2:
+            j = i
+            turns = 0
+            shifted = 1 if password[i] != unshift.get(password[i], password[i]) else 0
+            direction = None
+            while j + 1 < n:
+                key = unshift.get(password[j])
+                following = unshift.get(password[j + 1])
+                step = graph.get(key, {}).get(following) if key and following else None
+                if step is None:
+                    break
+                if step != direction:
+                    turns += 1
+                    direction = step
+                if password[j + 1] != following:
+                    shifted += 1
+                j += 1
+            length = j - i + 1
+            if length >= 3:
+                matches.append((i, j + 1, self._spatial_guesses(length, turns, shifted)))
+                i = j
+            else:
+                i += 1
+
+    def _spatial_guesses(self, length, turns, shifted):
+        keys, degree = len(self.graph), self.average_degree
+        guesses = 0
+        for i in range(2, length + 1):
+            for j in range(1, min(turns, i - 1) + 1):
+                guesses += math.comb(i - 1, j - 1) * keys * degree ** j
+        if shifted:
+            unshifted = length - shifted
+            if unshifted == 0:
+                guesses *= 2
+            else:
+                guesses *= sum(math.comb(length, k) for k in range(1, min(shifted, unshifted) + 1))
+        return int(guesses)
+
+    def _sequences(self, password, matches):
+        n = len(password)
+        i = 0
+        while i < n - 2:
+            delta = ord(password[i + 1]) - ord(password[i])
+            j = i + 1
+            if delta in (-1, 1):
+                while j + 1 < n and ord(password[j + 1]) - ord(password[j]) == delta:
+                    j += 1
+            length = j - i + 1
+            if length >= 3 and delta in (-1, 1):
+                first = password[i]
+                if first in "aAzZ019":
+                    base = 4
+                elif first.isdigit():
+                    base = 10
+                else:
+                    base = 26
+                matches.append((i, j + 1, base * length * (2 if delta < 0 else 1)))
+                i = j
+            else:
+                i += 1
+
+    def _repeats(self, password, matches):
+        for match in _REPEAT.finditer(password):
+            base = match.group(1)
+            if match.end() - match.start() < 3:
+                continue
+            repeats = (match.end() - match.start()) // len(base)
+            base_guesses = self.guesses(base) if len(base) > 1 else MIN_GUESSES_SINGLE_CHAR
+            matches.append((match.start(), match.end(), base_guesses * repeats))
+
+    def _dates(self, password, matches):
+        for match in _YEAR.finditer(password):
+            matches.append((match.start(), match.end(), _year_guesses(int(match.group()))))
+        for match in _DATE_SEPARATED.finditer(password):
+            parts = (int(match.group(1)), int(match.group(3)), int(match.group(4)))
+            year = _valid_date(parts)
+            if year is not None:
+                matches.append((match.start(), match.end(), 365 * _year_guesses(year) * 4))
+        for match in _DIGITS.finditer(password):
+            digits = match.group()
+            for start in range(len(digits)):
+                for length in (6, 8):
+                    token = digits[start:start + length]
+                    if len(token) != length:
+                        continue
+                    year = None
+                    for split in ((2, 4), (4, 6), (2, 6)) if length == 8 else ((2, 4),):
+                        parts = (int(token[:split[0]]), int(token[split[0]:split[1]]), int(token[split[1]:]))
+                        year = _valid_date(parts)
+                        if year is not None:
+                            break
+                    if year is not None:
+                        offset = match.start() + start
+                        matches.append((offset, offset + length, 365 * _year_guesses(year)))
+
+
+_ESTIMATORS = {}
+
+
+def load_estimator(words=None):
+    """Return an Estimator for a ranked word file, or the built-in words, built once per process"""
+    estimator = _ESTIMATORS.get(words)
+    if estimator is None:
+        estimator = _ESTIMATORS[words] = Estimator(words)
+    return estimator
@@ -0,0 +1,214 @@
+import argparse
+import hashlib
+import heapq
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from bisect import bisect_left
+
+from potfile import iter_lines
+
+MAGIC = b"PWHWLST1"
+
+# magic, distinct hashes, words read, bucket bits, byte order
+HEADER = struct.Struct("<8sQQB7s")
+
+# The top BUCKET_BITS bits of a hash select the slice of the sorted table that is searched
+BUCKET_BITS = 16
+
+# Hashes sorted in memory at once while building; larger wordlists are merged from sorted runs
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# Hashes read per step while merging runs
+_BLOCK = 65536
+
+
+def word_hash(word):
+    """64-bit hash of a word as stored in the index"""
+    return int.from_bytes(hashlib.blake2b(word.encode("utf-8", "surrogatepass"), digest_size=8).digest(), "big")
+
+
+def _write_run(hashes, directory):
+    run = tempfile.TemporaryFile(dir=directory)
+    array('Q', sorted(hashes)).tofile(run)
+    run.seek(0)
+    return run
+
+
+def _read_run(run):
+    while True:
+        block = array('Q')
+        try:
+            block.fromfile(run, _BLOCK)
+        except EOFError:
+            pass
+        if not block:
+            return
+        for value in block:
+            yield value
+
+
+def build_index(source, path, chunk_size=CHUNK_SIZE):
+    """Build the index of a wordlist (path, '-' or file object, compressed or not) at path.
+
+    The index is the sorted, deduplicated 64-bit hashes of the words, preceded by a table of where
+    each bucket of hashes starts. Wordlists too large to sort in memory are hashed in chunks that are
+    sorted into temporary runs and merged. With 64-bit hashes, a billion words give a false match
+    about once in 10^10 lookups. Returns (distinct words, words read).
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    runs = []
+    hashes = array('Q')
+    words = 0
+    for word in iter_lines(source):
+        if not word:
+            continue
+        hashes.append(word_hash(word))
+        words += 1
+        if len(hashes) >= chunk_size:
+            runs.append(_write_run(hashes, directory))
+            hashes = array('Q')
+    if runs:
+        runs.append(_write_run(hashes, directory))
+        merged = heapq.merge(*[_read_run(run) for run in runs])
+    else:
+        merged = iter(sorted(hashes))
+    del hashes
+
+    buckets = 1 << BUCKET_BITS
+    starts = array('Q', [0] * (buckets + 1))
+    shift = 64 - BUCKET_BITS
+    distinct = 0
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as out:
+        out.seek(HEADER.size + starts.itemsize * len(starts))
+        block = array('Q')
+        previous = None
+        for value in merged:
+            if value == previous:
+                continue
+            previous = value
+            block.append(value)
+            starts[(value >> shift) + 1] += 1
+            distinct += 1
+            if len(block) >= _BLOCK:
+                block.tofile(out)
+                block = array('Q')
+        block.tofile(out)
+        for bucket in range(buckets):
+            starts[bucket + 1] += starts[bucket]
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, distinct, words, BUCKET_BITS, sys.byteorder.encode("ascii")))
+        starts.tofile(out)
+    for run in runs:
+        run.close()
+    os.replace(tmp, path)
+    return distinct, words
+
+
+class WordlistIndex:
+    """Membership test against an index written by build_index.
+
+    The file is memory-mapped and used in place, so opening it only reads the header and lookups
+    touch a few pages: a hash, a bucket table lookup and a binary search within the bucket.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise ValueError("%s is not a wordlist index, build one with wordlist.py" % path)
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._open()
+        except ValueError:
+            self._mmap.close()
+            raise
+
+    def _open(self):
+        """Check the header and size of the mapped index and set up the bucket table and hash views"""
+        path = self.path
+        magic, self.distinct, self.words, bits, byteorder = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError("%s is not a wordlist index, build one with wordlist.py" % path)
+        if byteorder.rstrip(b"\0") != sys.byteorder.encode("ascii"):
+            raise ValueError("%s was built on a machine of a different byte order" % path)
+        if not 0 < bits < 32:
+            raise ValueError("%s is corrupt: %d bucket bits" % (path, bits))
+        table = HEADER.size + 8 * ((1 << bits) + 1)
+        if len(self._mmap) != table + 8 * self.distinct:
+            raise ValueError("%s is truncated or corrupt: %d bytes instead of %d"
+                             % (path, len(self._mmap), table + 8 * self.distinct))
+        self._shift = 64 - bits
+        view = memoryview(self._mmap)
+        self._starts = view[HEADER.size:table].cast('Q')
+        self._hashes = view[table:table + 8 * self.distinct].cast('Q')
+        starts = self._starts
+        if starts[0] != 0 or starts[-1] != self.distinct or any(a > b for a, b in zip(starts, starts[1:])):
+            self._starts.release()
+            self._hashes.release()
+            view.release()
+            raise ValueError("%s is corrupt: its bucket table does not match %d hashes" % (path, self.distinct))
+        view.release()
+
+    def __len__(self):
+        return self.distinct
+
+    def __contains__(self, word):
+        value = word_hash(word)
+        bucket = value >> self._shift
+        end = self._starts[bucket + 1]
+        position = bisect_left(self._hashes, value, self._starts[bucket], end)
+        return position < end and self._hashes[position] == value
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    def close(self):
+        self._starts.release()
+        self._hashes.release()
+        self._mmap.close()
+
+
+_OPEN = {}
+
+
+def open_index(path):
+    """Return a WordlistIndex of path, opened once per process, e.g. in StatsGen worker processes"""
+    index = _OPEN.get(path)
+    if index is None:
+        index = _OPEN[path] = WordlistIndex(path)
+    return index
+
+
+if __name__ == '__main__':
+    """Build a wordlist index for health.py --wordlist"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-w', '--wordlist',
+                        help="Wordlist with one password per line, gzip, bz2 and xz files are read directly, use - "
+                             "to read from stdin")
+    parser.add_argument('-o', '--output', required=True, help="Index file to write")
+    parser.add_argument('--chunk-size', default=CHUNK_SIZE, type=int,
+                        help="Words sorted in memory at once. Default is \033[0;0;92m%d\033[0m" % CHUNK_SIZE)
+    parser.add_argument('--check', nargs='+', help="Look these passwords up in an existing index instead")
+
+    args = parser.parse_args()
+    if args.check:
+        try:
+            index = WordlistIndex(args.output)
+        except (OSError, ValueError) as e:
+            parser.error("invalid index: %s" % e)
+        for password in args.check:
+            print("[+] %25s: %s" % (password, "in wordlist" if password in index else "not found"))
+        sys.exit(0)
+
+    if not args.wordlist:
+        parser.error("the -w/--wordlist to index is required")
+    started = time.time()
+    distinct, words = build_index(args.wordlist, args.output, args.chunk_size)
+    print("[*] Indexed %d distinct of %d words in %.1fs" % (distinct, words, time.time() - started))